@@ -0,0 +1,140 @@
+"""
+Micro-benchmarks for the prefix trees in lab_autocomplete.py.
+
+Run as:
+   python bench_autocomplete.py
+"""
+import random
+import string
+import timeit
+import tracemalloc
+
+from lab_autocomplete import CompactPrefixTree, PrefixTree, RadixPrefixTree
+
+
+def random_keys(count, length, seed=0):
+    """
+    Return a list of count distinct random lowercase keys of the given length.
+    """
+    rng = random.Random(seed)
+    keys = set()
+    while len(keys) < count:
+        keys.add(''.join(rng.choice(string.ascii_lowercase) for _ in range(length)))
+    return list(keys)
+
+
+def bench_operations(count=20000, lengths=(4, 16, 64), repeat=3):
+    """
+    Measure insert, lookup and delete throughput (operations per second) of
+    PrefixTree for keys of several lengths.  Returns a list of result dicts.
+    """
+    results = []
+    for length in lengths:
+        keys = random_keys(count, length)
+
+        def insert():
+            tree = PrefixTree()
+            for key in keys:
+                tree[key] = 1
+            return tree
+
+        tree = insert()
+
+        def lookup():
+            for key in keys:
+                tree[key]
+
+        fresh = []
+
+        def build():
+            fresh.append(insert())
+
+        def delete():
+            t = fresh.pop()
+            for key in keys:
+                del t[key]
+
+        insert_time = min(timeit.repeat(insert, number=1, repeat=repeat))
+        lookup_time = min(timeit.repeat(lookup, number=1, repeat=repeat))
+        # deleting needs a freshly built tree, which the (untimed) setup makes
+        delete_time = min(timeit.repeat(delete, setup=build, number=1, repeat=repeat))
+
+        results.append({
+            'length': length,
+            'insert_per_sec': count / insert_time,
+            'lookup_per_sec': count / lookup_time,
+            'delete_per_sec': count / delete_time,
+        })
+    return results
+
+
+def random_words(count, seed=0):
+    """
+    Return count distinct random lowercase words with lengths between 3 and
+    15, which (unlike random_keys) share prefixes the way real words do.
+    """
+    rng = random.Random(seed)
+    stems = [''.join(rng.choice(string.ascii_lowercase) for _ in range(4))
+             for _ in range(max(count // 50, 1))]
+    words = set()
+    while len(words) < count:
+        tail = ''.join(rng.choice(string.ascii_lowercase)
+                       for _ in range(rng.randint(0, 11)))
+        words.add(rng.choice(stems)[:rng.randint(3, 4)] + tail)
+    return list(words)
+
+
+def bench_tree_types(count=50000, repeat=3):
+    """
+    Compare memory use (bytes allocated while building, via tracemalloc)
+    and lookup throughput of PrefixTree, RadixPrefixTree and
+    CompactPrefixTree holding the same words.  Returns a list of result
+    dicts.
+    """
+    words = random_words(count)
+    builders = [
+        ('PrefixTree', PrefixTree),
+        ('RadixPrefixTree', RadixPrefixTree),
+    ]
+    results = []
+    for name, cls in builders:
+        tracemalloc.start()
+        tree = cls()
+        for word in words:
+            tree[word] = 1
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results.append((name, tree, memory))
+
+    tracemalloc.start()
+    tree = CompactPrefixTree((word, 1) for word in words)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    results.append(('CompactPrefixTree', tree, memory))
+
+    rows = []
+    for name, tree, memory in results:
+        def lookup():
+            for word in words:
+                tree[word]
+        lookup_time = min(timeit.repeat(lookup, number=1, repeat=repeat))
+        rows.append({
+            'tree': name,
+            'bytes_per_word': memory / count,
+            'lookup_per_sec': count / lookup_time,
+        })
+    return rows
+
+
+def print_table(results):
+    columns = list(results[0])
+    print(' '.join('%18s' % c for c in columns))
+    for row in results:
+        print(' '.join('%18s' % row[c] if isinstance(row[c], str) else '%18.0f' % row[c]
+                       for c in columns))
+
+
+if __name__ == '__main__':
+    print_table(bench_operations())
+    print()
+    print_table(bench_tree_types())
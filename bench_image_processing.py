@@ -0,0 +1,264 @@
+"""
+Benchmarks for the filters in lab_image_processing_2.py.
+
+Run as:
+   python bench_image_processing.py
+or, to save machine-readable results for comparing across commits:
+   python bench_image_processing.py --json results.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import timeit
+import tracemalloc
+
+import lab_image_processing_2 as lab
+
+
+def random_greyscale_image(height, width, seed=0):
+    rng = random.Random(seed)
+    return {
+        'height': height,
+        'width': width,
+        'pixels': [rng.randrange(256) for _ in range(height * width)],
+    }
+
+
+def random_color_image(height, width, seed=0):
+    rng = random.Random(seed)
+    return {
+        'height': height,
+        'width': width,
+        'pixels': [tuple(rng.randrange(256) for _ in range(3)) for _ in range(height * width)],
+    }
+
+
+def bench_correlate(sizes=((64, 64), (256, 256)), kernel_sizes=(3, 5, 9), repeat=3):
+    """
+    Time correlate with the NumPy backend and with the pure-Python path
+    (NumPy hidden from the module) on random images, and check that both
+    produce the same pixels.  Returns a list of result dicts.
+    """
+    results = []
+    numpy = lab.np
+    for height, width in sizes:
+        image = random_greyscale_image(height, width)
+        for n in kernel_sizes:
+            kernel = [1 / n**2] * n**2
+            row = {'size': '%dx%d' % (height, width), 'kernel': n}
+            outputs = []
+            for backend, module in (('numpy', numpy), ('python', None)):
+                if backend == 'numpy' and numpy is None:
+                    continue
+                lab.np = module
+                try:
+                    outputs.append(lab.correlate(image, kernel, 'extend')['pixels'])
+                    row[backend + '_sec'] = min(timeit.repeat(
+                        lambda: lab.correlate(image, kernel, 'extend'), number=1, repeat=repeat))
+                finally:
+                    lab.np = numpy
+            row['match'] = all(o == outputs[0] for o in outputs)
+            results.append(row)
+    return results
+
+
+def bench_seam_carving(size=(96, 128), targets=((96, 96), (72, 128), (72, 96), (96, 160)), repeat=1):
+    """
+    Time resizing a random color image of the given (height, width) to each
+    target (height, width) with retarget, and removing the same number of
+    columns with seam_carving using the incremental and the full
+    recomputation.  Returns a list of result dicts.
+    """
+    height, width = size
+    image = random_color_image(height, width)
+    results = []
+    for new_height, new_width in targets:
+        row = {'target': '%dx%d' % (new_height, new_width)}
+        row['retarget_sec'] = min(timeit.repeat(
+            lambda: lab.retarget(image, new_height, new_width), number=1, repeat=repeat))
+        ncols = width - new_width
+        if ncols > 0:
+            for mode, incremental in (('incremental', True), ('full', False)):
+                row[mode + '_sec'] = min(timeit.repeat(
+                    lambda: lab.seam_carving(image, ncols, incremental), number=1, repeat=repeat))
+        results.append(row)
+    return results
+
+
+def reference_correlate(image, kernel, boundary_behavior):
+    """
+    Straightforward correlation reading every input pixel through
+    lab.get_pixel, used to check the optimized backends.
+    """
+    n = int(math.sqrt(len(kernel)))
+    mid = n // 2
+    pixels = []
+    for x in range(image['height']):
+        for y in range(image['width']):
+            total = 0
+            for j in range(n):
+                for k in range(n):
+                    total += kernel[n*j + k] * lab.get_pixel(image, x + j - mid, y + k - mid, boundary_behavior)
+            pixels.append(total)
+    return {'height': image['height'], 'width': image['width'], 'pixels': pixels}
+
+
+def reference_edges(image):
+    ox = reference_correlate(image, [-1, 0, 1, -2, 0, 2, -1, 0, 1], 'extend')['pixels']
+    oy = reference_correlate(image, [-1, -2, -1, 0, 0, 0, 1, 2, 1], 'extend')['pixels']
+    magnitude = [round(math.sqrt(a*a + b*b)) for a, b in zip(ox, oy)]
+    return lab.round_and_clip_image({'height': image['height'], 'width': image['width'], 'pixels': magnitude})
+
+
+def box_kernel(n):
+    return [1 / n**2] * n**2
+
+
+def sharpen_kernel(n):
+    kernel = [-1 / n**2] * n**2
+    kernel[n**2 // 2] = 2 - 1 / n**2
+    return kernel
+
+
+def filter_cases(kernel_sizes):
+    """
+    Return (name, kernel size, color, filter, reference, exact) tuples for
+    the filters to benchmark.  reference computes the expected output
+    without the optimized paths; exact says whether the outputs must match
+    exactly (rounded filters) or only to floating-point accuracy (correlate).
+    """
+    cases = []
+    for n in kernel_sizes:
+        cases.append(('correlate', n, False,
+                      lambda image, n=n: lab.correlate(image, box_kernel(n), 'extend'),
+                      lambda image, n=n: reference_correlate(image, box_kernel(n), 'extend'), False))
+        cases.append(('blur', n, False, lab.make_blur_filter(n),
+                      lambda image, n=n: lab.round_and_clip_image(reference_correlate(image, box_kernel(n), 'extend')),
+                      True))
+        cases.append(('sharpen', n, False, lab.make_sharpen_filter(n),
+                      lambda image, n=n: lab.round_and_clip_image(reference_correlate(image, sharpen_kernel(n), 'extend')),
+                      True))
+        cases.append(('color_blur', n, True, lab.color_filter_from_greyscale_filter(lab.make_blur_filter(n)),
+                      lambda image, n=n: reference_color(image, lambda channel: lab.round_and_clip_image(
+                          reference_correlate(channel, box_kernel(n), 'extend'))),
+                      True))
+    cases.append(('edges', 3, False, lab.edges, reference_edges, True))
+    cases.append(('inverted', 1, False, lab.inverted,
+                  lambda image: dict(image, pixels=[255 - p for p in image['pixels']]), True))
+    cases.append(('color_edges', 3, True, lab.color_filter_from_greyscale_filter(lab.edges),
+                  lambda image: reference_color(image, reference_edges), True))
+    cases.append(('seam_carving', 8, True, lambda image: lab.seam_carving(image, 8),
+                  lambda image: lab.seam_carving(image, 8, incremental=False), True))
+    return cases
+
+
+def reference_color(image, greyscale_filter):
+    channels = [greyscale_filter(dict(image, pixels=[p[i] for p in image['pixels']])) for i in range(3)]
+    return dict(image, pixels=list(zip(*(c['pixels'] for c in channels))))
+
+
+def outputs_match(got, expected, exact):
+    got = lab.list_image(got) if isinstance(got, dict) else got
+    if (got['height'], got['width']) != (expected['height'], expected['width']):
+        return False
+    if exact:
+        return list(got['pixels']) == list(expected['pixels'])
+    return all(abs(a - b) <= 1e-9 * max(1, abs(b)) for a, b in zip(got['pixels'], expected['pixels']))
+
+
+def bench_filters(resolutions=((64, 64), (128, 128)), kernel_sizes=(3, 5, 9), repeat=3, check=True):
+    """
+    Run every filter from filter_cases on synthetic images of each (height,
+    width) resolution, with the NumPy backend (if installed) and with the
+    pure-Python one.  For each run, record the best wall time over repeat
+    runs, the pixels per second, the peak memory allocated during one run
+    (measured separately, with tracemalloc) and, if check is True, whether
+    the output matches the reference.  Returns a list of result dicts.
+    """
+    numpy = lab.np
+    backends = [('numpy', numpy)] * (numpy is not None) + [('python', None)]
+    results = []
+    for height, width in resolutions:
+        grey = random_greyscale_image(height, width)
+        color = random_color_image(height, width)
+        for name, n, is_color, filt, reference, exact in filter_cases(kernel_sizes):
+            image = color if is_color else grey
+            expected = reference(image) if check else None
+            for backend, module in backends:
+                lab.np = module
+                try:
+                    seconds = min(timeit.repeat(lambda: filt(image), number=1, repeat=repeat))
+                    tracemalloc.start()
+                    output = filt(image)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                finally:
+                    lab.np = numpy
+                row = {
+                    'filter': name,
+                    'n': n,
+                    'size': '%dx%d' % (height, width),
+                    'backend': backend,
+                    'seconds': seconds,
+                    'pixels_per_sec': height * width / seconds,
+                    'peak_bytes': peak,
+                }
+                if check:
+                    row['match'] = outputs_match(output, expected, exact)
+                results.append(row)
+    return results
+
+
+def environment():
+    """
+    Describe where the benchmark ran, so saved results can be compared
+    across commits.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': lab.np.__version__ if lab.np is not None else None,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def print_table(results):
+    columns = []
+    for row in results:
+        columns.extend(c for c in row if c not in columns)
+    print(' '.join('%14s' % c for c in columns))
+    for row in results:
+        print(' '.join('%14.4f' % row[c] if isinstance(row.get(c), float) else '%14s' % row.get(c, '')
+                       for c in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--json', metavar='PATH', help='also write the results to PATH as JSON')
+    parser.add_argument('--sizes', default='64x64,128x128', help='comma-separated HEIGHTxWIDTH resolutions')
+    parser.add_argument('--kernels', default='3,5,9', help='comma-separated kernel sizes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-check', action='store_true', help='skip comparing outputs with the reference')
+    args = parser.parse_args()
+
+    resolutions = [tuple(int(v) for v in size.split('x')) for size in args.sizes.split(',')]
+    kernel_sizes = [int(n) for n in args.kernels.split(',')]
+    results = bench_filters(resolutions, kernel_sizes, args.repeat, not args.no_check)
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=1)
+    print()
+    print_table(bench_correlate())
+    print()
+    print_table(bench_seam_carving())
@@ -1,11 +1,26 @@
 # NO ADDITIONAL IMPORTS!
+# (except from the standard library, which the faster tree types below use)
+import collections
 import doctest
+import heapq
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+from array import array
 from text_tokenize import tokenize_sentences
 
 class PrefixTree:
+    __slots__ = ('value', 'children', 'best')
+
+    # number of most frequent completions cached at each node
+    TOP_K = 10
+
     def __init__(self):
         self.value = None
         self.children = {}
+        self.best = None  # cached top completions; None when out of date
 
     def __setitem__(self, key, value):
         """
@@ -14,22 +29,21 @@ class PrefixTree:
         immutable ordered sequence.  Raise a TypeError if the given key is not
         a string.
         """
-
-        if not isinstance(key, str): 
+        if not isinstance(key, str):
             raise TypeError
+        if len(key) == 0:
+            raise KeyError
 
-        if key[0] in self.children:
-            node = self.children[key[0]]
-        
-        else:
-            node = PrefixTree()
-            self.children[key[0]] = node
-
-        if len(key) == 1:
-            node.value = value
-        else:
-            node[key[1:]] = value  
-
+        node = self
+        for char in key:
+            node.best = None
+            child = node.children.get(char)
+            if child is None:
+                child = PrefixTree()
+                node.children[char] = child
+            node = child
+        node.value = value
+        node.best = None
 
     def __getitem__(self, key):
         """
@@ -37,25 +51,20 @@ class PrefixTree:
         the prefix tree, raise a KeyError.  If the given key is not a string,
         raise a TypeError.
         """
-
         if not isinstance(key, str):
             raise TypeError
-        
-        if key[0] in self.children:
-            node = self.children[key[0]]
-        
-        else:
+        if len(key) == 0:
             raise KeyError
 
-        if len(key) == 1: 
-            if node.value is None:
+        node = self
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
                 raise KeyError
-            else:
-                return node.value 
+        if node.value is None:
+            raise KeyError
+        return node.value
 
-        else:
-            return node[key[1:]]
-        
     def get_node(self, key):
         """
         Return the node for the specified prefix. If the given key is not a string,
@@ -63,43 +72,71 @@ class PrefixTree:
         """
         if not isinstance(key, str):
             raise TypeError
-        
-        if len(key) == 0:
-            return self
-
-        if key[0] in self.children:
-            node = self.children[key[0]]
-        
-        else:
-            return None
-
-        if len(key) == 1: 
-            return node 
 
-        else:
-            return node.get_node(key[1:])
+        node = self
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
 
     def __delitem__(self, key):
         """
         Delete the given key from the prefix tree if it exists. If the given
         key is not in the prefix tree, raise a KeyError.  If the given key is
         not a string, raise a TypeError.
+
+        Nodes left with neither a value nor children are removed, so deleting
+        every key returns the tree to its empty state.
         """
         if not isinstance(key, str):
             raise TypeError
-        if key not in self:
+        if len(key) == 0:
             raise KeyError
 
-        if key[0] in self.children:
-            node = self.children[key[0]]
-        
-        else:
+        # remember the path so that empty branches can be pruned afterwards
+        path = []
+        node = self
+        for char in key:
+            path.append(node)
+            node = node.children.get(char)
+            if node is None:
+                raise KeyError
+        if node.value is None:
             raise KeyError
+        node.value = None
+        node.best = None
+        for parent in path:
+            parent.best = None
 
-        if len(key) == 1:
-            node.value = None
-        else:
-            del node[key[1:]]
+        for i in range(len(key) - 1, -1, -1):
+            if node.value is not None or node.children:
+                break
+            node = path[i]
+            del node.children[key[i]]
+
+    def increment(self, key, amount=1):
+        """
+        Add amount to the value associated with key, treating a missing key as
+        having value 0.  Equivalent to tree[key] = tree.get(key, 0) + amount
+        but walks the key only once.  Raise a TypeError if the given key is not
+        a string.
+        """
+        if not isinstance(key, str):
+            raise TypeError
+        if len(key) == 0:
+            raise KeyError
+
+        node = self
+        for char in key:
+            node.best = None
+            child = node.children.get(char)
+            if child is None:
+                child = PrefixTree()
+                node.children[char] = child
+            node = child
+        node.value = amount if node.value is None else node.value + amount
+        node.best = None
 
     def __contains__(self, key):
         """
@@ -108,56 +145,890 @@ class PrefixTree:
         """
         if not isinstance(key, str):
             raise TypeError
-        
         if len(key) == 0:
             return False
-        
-        if key[0] in self.children:
-            node = self.children[key[0]]
-        else:
-            return False
 
-        if len(key) == 1:
-            if node.value is None:
+        node = self
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
                 return False
-            return True
-
-        return key[1:] in node
+        return node.value is not None
 
     def __iter__(self):
         """
         Generator of (key, value) pairs for all keys/values in this prefix tree
         and its children.  Must be a generator!
         """
-        for child in self.children:
-            key = child
-            if self.children[child].value is not None:
-                value = self.children[child].value
-                yield (key, value)
-                
-            if self.children[child].children != {}:
-                for k, val in self.children[child]:
-                    yield (key + k, val)   
+        return self._walk(False)
 
-def word_frequencies(text):
+    def _walk(self, ordered):
+        """
+        Generator of (key, value) pairs for all keys strictly below this node,
+        with keys relative to this node.  Uses an explicit stack of child
+        iterators and a single character buffer holding the current path, so
+        each key is built once with ''.join instead of being re-concatenated
+        at every level.  If ordered is true, keys come out in lexicographic
+        order; otherwise children are visited in insertion order.
+        """
+        def child_items(node):
+            if ordered:
+                return iter(sorted(node.children.items()))
+            return iter(node.children.items())
+
+        buffer = []
+        stack = [child_items(self)]
+        while stack:
+            for char, child in stack[-1]:
+                buffer.append(char)
+                if child.value is not None:
+                    yield (''.join(buffer), child.value)
+                if child.children:
+                    stack.append(child_items(child))
+                    break
+                buffer.pop()
+            else:
+                stack.pop()
+                if buffer:
+                    buffer.pop()
+
+    def iter_items(self, prefix='', ordered=False):
+        """
+        Generator of (key, value) pairs for all keys in this prefix tree that
+        start with prefix (including prefix itself), optionally in
+        lexicographic order.  Nothing is materialized, so callers can stop
+        early.  If the given prefix is not a string, raise a TypeError.
+        """
+        node = self.get_node(prefix)
+        if node is None:
+            return
+        if prefix and node.value is not None:
+            yield (prefix, node.value)
+        for key, value in node._walk(ordered):
+            yield (prefix + key, value)
+
+    def best_completions(self):
+        """
+        Return a list of up to TOP_K (key, value) pairs with the largest
+        values among this node and its descendants, largest first.  Keys are
+        relative to this node ('' being the node itself).
+
+        Each node caches its top completions as a tuple of the nodes holding
+        them, so no key is stored (or copied) at every level above it; keys
+        are spelled out only for the pairs returned here (see _key_to).  Insertions and
+        deletions clear the cache on every node along the key's path.
+        """
+        return [(self._key_to(node), node.value) for node in self._top()]
+
+    def _top(self):
+        """
+        Return this node's cached tuple of up to TOP_K nodes with the largest
+        values in its subtree, largest first, filling in any out-of-date
+        caches below it children first (with an explicit stack, so key length
+        is not limited by the recursion limit).
+        """
+        if self.best is None:
+            stack = [(self, False)]
+            while stack:
+                node, expanded = stack.pop()
+                if not expanded:
+                    stack.append((node, True))
+                    stack.extend((child, False) for child in node.children.values() if child.best is None)
+                    continue
+                candidates = []
+                if node.value is not None:
+                    candidates.append(node)
+                for child in node.children.values():
+                    candidates.extend(child.best)
+                node.best = tuple(heapq.nlargest(self.TOP_K, candidates, key=lambda x: x.value))
+        return self.best
+
+    def _key_to(self, target):
+        """
+        Return the key of target (a node from this node's cached top
+        completions) relative to this node.  While this
+        node's cache is valid so are those of all of its descendants, and
+        target is in the cache of each node on the way down, so every step
+        only looks at the children whose cached values bracket target's.
+        """
+        value = target.value
+        chars = []
+        node = self
+        while node is not target:
+            for char, child in node.children.items():
+                best = child.best
+                if best and best[-1].value <= value <= best[0].value and any(n is target for n in best):
+                    chars.append(char)
+                    node = child
+                    break
+        return ''.join(chars)
+
+    def most_frequent(self, k):
+        """
+        Return a list of the k (key, value) pairs with the largest values
+        among this node and its descendants, largest first, with keys
+        relative to this node.
+
+        For k up to TOP_K this is read straight from the cached completions.
+        Otherwise it runs a best-first search that uses the largest cached
+        value of each subtree as its priority, so only the branches that can
+        still contribute to the answer are expanded.
+        """
+        top = self._top()
+        if k <= self.TOP_K or len(top) < self.TOP_K:
+            return [(self._key_to(node), node.value) for node in top[:k]]
+
+        result = []
+        count = 0  # tie-breaker so the heap never compares nodes
+        heap = [(-top[0].value, count, '', self)]
+        while heap and len(result) < k:
+            priority, _, key, node = heapq.heappop(heap)
+            if node is None:
+                result.append((key, -priority))
+                continue
+            if node.value is not None:
+                count += 1
+                heapq.heappush(heap, (-node.value, count, key, None))
+            for char, child in node.children.items():
+                child_top = child._top()
+                if child_top:
+                    count += 1
+                    heapq.heappush(heap, (-child_top[0].value, count, key + char, child))
+        return result
+
+class _CompactNode:
     """
-    Given a piece of text as a single string, create a prefix tree whose keys
-    are the words in the text, and whose values are the number of times the
-    associated word appears in the text.
+    Lightweight view of one node of a CompactPrefixTree.  Views are created
+    on demand and only hold a reference to the shared arrays plus the index of
+    the node, so they support the same read-only interface as PrefixTree
+    (value, children, get_node, indexing, membership and iteration).
     """
-    text = tokenize_sentences(text)
-    word_dict = {} # a dict mapping words to their frequencies
-    for t in text:
+    __slots__ = ('_trie', '_index')
+
+    def __init__(self, trie, index):
+        self._trie = trie
+        self._index = index
+
+    @property
+    def value(self):
+        return self._trie._values[self._index]
+
+    @property
+    def children(self):
+        trie = self._trie
+        labels = trie._labels
+        return {
+            chr(labels[i]): _CompactNode(trie, i)
+            for i in range(trie._first[self._index], trie._first[self._index + 1])
+        }
+
+    def _find(self, key):
+        """
+        Return the index of the node reached by following key from this node,
+        or -1 if there is no such node.  Children of a node are stored next to
+        each other in sorted order, so each step is a binary search.
+        """
+        first = self._trie._first
+        labels = self._trie._labels
+        index = self._index
+        for char in key:
+            code = ord(char)
+            lo = first[index]
+            end = hi = first[index + 1]
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if labels[mid] < code:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo == end or labels[lo] != code:
+                return -1
+            index = lo
+        return index
+
+    def get_node(self, key):
+        """
+        Return the node for the specified prefix, or None if there is none.
+        If the given key is not a string, raise a TypeError.
+        """
+        if not isinstance(key, str):
+            raise TypeError
+        index = self._find(key)
+        if index == -1:
+            return None
+        return _CompactNode(self._trie, index)
+
+    def __getitem__(self, key):
+        """
+        Return the value for the specified key.  If the given key is not in
+        the prefix tree, raise a KeyError.  If the given key is not a string,
+        raise a TypeError.
+        """
+        if not isinstance(key, str):
+            raise TypeError
+        if len(key) == 0:
+            raise KeyError
+        index = self._find(key)
+        if index == -1 or self._trie._values[index] is None:
+            raise KeyError
+        return self._trie._values[index]
+
+    def __contains__(self, key):
+        """
+        Is key a key in the prefix tree?  Return True or False.  If the given
+        key is not a string, raise a TypeError.
+        """
+        if not isinstance(key, str):
+            raise TypeError
+        if len(key) == 0:
+            return False
+        index = self._find(key)
+        return index != -1 and self._trie._values[index] is not None
+
+    def __iter__(self):
+        """
+        Generator of (key, value) pairs for all keys below this node, in
+        lexicographic order.
+
+        The columns are looked up on the tree at every step rather than kept
+        in locals, so a suspended generator does not hold on to the buffers
+        of a MappedPrefixTree (which would stop it from being closed); once
+        the tree is closed, resuming the generator raises a TypeError.
+        """
+        trie = self._trie
+        # same explicit stack and shared key buffer as PrefixTree._walk; the
+        # children of node i are the index range first[i]:first[i + 1]
+        buffer = []
+        stack = [iter(range(trie._first[self._index], trie._first[self._index + 1]))]
+        while stack:
+            for i in stack[-1]:
+                buffer.append(chr(trie._labels[i]))
+                value = trie._values[i]
+                if value is not None:
+                    yield (''.join(buffer), value)
+                first = trie._first
+                if first[i] < first[i + 1]:
+                    stack.append(iter(range(first[i], first[i + 1])))
+                    break
+                buffer.pop()
+            else:
+                stack.pop()
+                if buffer:
+                    buffer.pop()
+
+    def iter_items(self, prefix='', ordered=True):
+        """
+        Generator of (key, value) pairs for all keys that start with prefix
+        (including prefix itself).  Keys are always in lexicographic order.
+        """
+        node = self.get_node(prefix)
+        if node is None:
+            return
+        if prefix and node.value is not None:
+            yield (prefix, node.value)
+        for key, value in node:
+            yield (prefix + key, value)
+
+    def most_frequent(self, k):
+        """
+        Return a list of the k (key, value) pairs with the largest values
+        among this node and its descendants, largest first, with keys
+        relative to this node.
+        """
+        items = iter(self)
+        if self.value is not None:
+            items = [('', self.value)] + list(items)
+        return heapq.nlargest(k, items, key=lambda x: x[1])
+
+
+class CompactPrefixTree(_CompactNode):
+    """
+    Read-only prefix tree stored as flat arrays instead of one object per
+    character.  Nodes are numbered in level order (as in a LOUDS trie), so the
+    children of node i are exactly the nodes first[i] to first[i + 1] - 1, and
+    they are sorted by their label.  Only the values need a Python list.
+
+    Built from any iterable of (key, value) pairs, including a PrefixTree:
+       compact = CompactPrefixTree(word_frequencies(text))
+    """
+    __slots__ = ('_first', '_labels', '_values')
+
+    def __init__(self, items=()):
+        super().__init__(self, 0)
+        word_dict = {}
+        for key, value in items:
+            if not isinstance(key, str):
+                raise TypeError
+            word_dict[key] = value
+        keys = sorted(word_dict)
+
+        first = array('L')
+        labels = array('L', [0])
+        values = []
+
+        # each queued node covers the sorted keys keys[lo:hi] that share the
+        # prefix of length depth leading to it; nodes are queued in level
+        # order so that the children of every node end up contiguous
+        queue = [(0, len(keys), 0)]
+        for lo, hi, depth in queue:
+            first.append(len(queue))
+            if lo < hi and len(keys[lo]) == depth:
+                values.append(word_dict[keys[lo]] if depth else None)
+                lo += 1
+            else:
+                values.append(None)
+            while lo < hi:
+                char = keys[lo][depth]
+                end = lo + 1
+                while end < hi and keys[end][depth] == char:
+                    end += 1
+                queue.append((lo, end, depth + 1))
+                labels.append(ord(char))
+                lo = end
+        first.append(len(queue))
+
+        self._first = first
+        self._labels = labels
+        self._values = values
+
+    def save(self, filename):
+        """
+        Write this tree to the given file in the binary format read by
+        MappedPrefixTree.  All values must be integers (e.g. frequencies).
+
+        Layout (little-endian, every section padded to 8 bytes):
+           8-byte magic, 8-byte node count n,
+           n + 1 uint32 child offsets, n uint32 labels, n int64 values
+        """
+        count = len(self._values)
+        first = array('I', self._first)
+        labels = array('I', self._labels)
+        values = array('q')
+        for value in self._values:
+            if value is None:
+                values.append(_MISSING)
+            elif isinstance(value, int):
+                values.append(value)
+            else:
+                raise TypeError('only integer values can be saved')
+        if sys.byteorder != 'little':
+            for column in (first, labels, values):
+                column.byteswap()
+
+        with open(filename, 'wb') as f:
+            f.write(_MAGIC)
+            f.write(struct.pack('<Q', count))
+            for column in (first, labels, values):
+                data = column.tobytes()
+                f.write(data)
+                f.write(b'\0' * (-len(data) % 8))
+
+
+# header of files written by CompactPrefixTree.save, and the stored value
+# that stands for "no value"
+_MAGIC = b'PTRIE\0\0\1'
+_MISSING = -(1 << 63)
+
+class _MappedValues:
+    """
+    Read-only sequence over the int64 value column of a mapped tree that
+    turns the missing-value marker back into None.
+    """
+    __slots__ = ('_column',)
+
+    def __init__(self, column):
+        self._column = column
+
+    def __len__(self):
+        return len(self._column)
+
+    def __getitem__(self, index):
+        value = self._column[index]
+        return None if value == _MISSING else value
+
+class MappedPrefixTree(CompactPrefixTree):
+    """
+    A CompactPrefixTree read directly from a file written by
+    CompactPrefixTree.save, through a read-only memory map.  Nothing is
+    decoded on load: lookups read the mapped columns in place, so opening is
+    instant regardless of the size of the tree, and every process that maps
+    the same file shares one copy of it in the OS page cache.  Pickling a
+    MappedPrefixTree (e.g. to send it to a multiprocessing worker) just
+    re-opens the file on the other side.  A file that is not a complete
+    saved tree raises ValueError (and is closed again).
+
+       tree = MappedPrefixTree('words.trie')
+       autocomplete(tree, 'th', 5)
+    """
+    __slots__ = ('_filename', '_file', '_mmap')
+
+    def __init__(self, filename):
+        _CompactNode.__init__(self, self, 0)
+        if sys.byteorder != 'little':
+            raise ValueError('mapped prefix trees need a little-endian machine')
+        self._filename = filename
+        self._mmap = None
+        self._file = open(filename, 'rb')
+        try:
+            self._map_columns()
+        except Exception:
+            self.close()
+            raise
+
+    def _map_columns(self):
+        # map the file and set up the three columns as views into it,
+        # checking the header and the size first
+        if os.fstat(self._file.fileno()).st_size < 16:
+            raise ValueError('not a saved prefix tree: %r' % self._filename)
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:8] != _MAGIC:
+            raise ValueError('not a saved prefix tree: %r' % self._filename)
+        count, = struct.unpack('<Q', self._mmap[8:16])
+
+        sections = []
+        offset = 16
+        for length, size, code in ((count + 1, 4, 'I'), (count, 4, 'I'), (count, 8, 'q')):
+            end = offset + length * size
+            sections.append((offset, end, code))
+            offset = end + (-end % 8)
+        if end > len(self._mmap):
+            raise ValueError('not a saved prefix tree: %r' % self._filename)
+
+        columns = []
+        with memoryview(self._mmap) as view:
+            for start, end, code in sections:
+                with view[start:end] as column:
+                    columns.append(column.cast(code))
+        self._first, self._labels, values = columns
+        self._values = _MappedValues(values)
+
+    def close(self):
+        """
+        Release the memory map.  Nodes obtained from this tree must not be
+        used afterwards, and generators over it that are still running raise
+        an error when resumed.
+
+        If something else still holds a view of the map's memory (e.g. a
+        memoryview taken from one of the columns), the map cannot be closed
+        yet; it is then left for the garbage collector to close once the
+        last view is gone, and the tree is closed all the same.
+        """
+        if self._mmap is not None:
+            if getattr(self, '_values', None) is not None:
+                for column in (self._first, self._labels, self._values._column):
+                    column.release()
+            self._first = self._labels = self._values = None
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+        if self._file is not None:
+            self._file.close()
+        self._mmap = self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __reduce__(self):
+        return (MappedPrefixTree, (self._filename,))
+
+class _RadixNode:
+    """
+    Node of a RadixPrefixTree.  The edge leading into the node is labelled
+    with a whole substring rather than a single character; children are
+    keyed by the first character of their label.
+    """
+    __slots__ = ('label', 'value', 'children')
+
+    def __init__(self, label, value=None):
+        self.label = label
+        self.value = value
+        self.children = {}
+
+class _RadixPosition:
+    """
+    A position in a RadixPrefixTree: offset characters along the edge into
+    node (offset == len(node.label) being the node itself).  Positions
+    partway along an edge stand for the per-character nodes that the path
+    compression removed, so get_node works for any prefix and positions
+    support the same read-only interface as PrefixTree nodes.
+    """
+    __slots__ = ('_node', '_offset')
+
+    def __init__(self, node, offset):
+        self._node = node
+        self._offset = offset
+
+    @property
+    def value(self):
+        if self._offset == len(self._node.label):
+            return self._node.value
+        return None
+
+    @property
+    def children(self):
+        node, offset = self._node, self._offset
+        if offset < len(node.label):
+            return {node.label[offset]: _RadixPosition(node, offset + 1)}
+        return {char: _RadixPosition(child, 1) for char, child in node.children.items()}
+
+    def _find(self, key):
+        """
+        Return the (node, offset) pair reached by following key from this
+        position, or None if there is no such position.  Whole edge labels are
+        compared at once.
+        """
+        node, offset = self._node, self._offset
+        i = 0
+        n = len(key)
+        while i < n:
+            label = node.label
+            if offset == len(label):
+                node = node.children.get(key[i])
+                if node is None:
+                    return None
+                label = node.label
+                offset = 0
+            if key.startswith(label[offset:] if offset else label, i):
+                # the whole rest of the edge matches (the common case)
+                i += len(label) - offset
+                offset = len(label)
+                continue
+            length = min(len(label) - offset, n - i)
+            if label[offset:offset + length] != key[i:i + length]:
+                return None
+            return node, offset + length
+        return node, offset
+
+    def get_node(self, key):
+        """
+        Return the position for the specified prefix, or None if there is
+        none.  If the given key is not a string, raise a TypeError.
+        """
+        if not isinstance(key, str):
+            raise TypeError
+        found = self._find(key)
+        if found is None:
+            return None
+        return _RadixPosition(*found)
+
+    def __getitem__(self, key):
+        """
+        Return the value for the specified key.  If the given key is not in
+        the prefix tree, raise a KeyError.  If the given key is not a string,
+        raise a TypeError.
+        """
+        if not isinstance(key, str):
+            raise TypeError
+        if len(key) == 0:
+            raise KeyError
+        found = self._find(key)
+        if found is None or found[1] != len(found[0].label) or found[0].value is None:
+            raise KeyError
+        return found[0].value
+
+    def __contains__(self, key):
+        """
+        Is key a key in the prefix tree?  Return True or False.  If the given
+        key is not a string, raise a TypeError.
+        """
+        if not isinstance(key, str):
+            raise TypeError
+        if len(key) == 0:
+            return False
+        found = self._find(key)
+        return (found is not None and found[1] == len(found[0].label)
+                and found[0].value is not None)
+
+    def _walk(self, ordered):
+        """
+        Generator of (key, value) pairs for all keys strictly below this
+        position, with keys relative to it.  Same explicit stack and shared
+        buffer as PrefixTree._walk, except that the buffer holds edge labels.
+        """
+        def child_nodes(node):
+            if ordered:
+                return iter([node.children[c] for c in sorted(node.children)])
+            return iter(node.children.values())
+
+        node, offset = self._node, self._offset
+        buffer = []
+        if offset < len(node.label):
+            buffer.append(node.label[offset:])
+            if node.value is not None:
+                yield (buffer[0], node.value)
+        stack = [child_nodes(node)]
+        while stack:
+            for child in stack[-1]:
+                buffer.append(child.label)
+                if child.value is not None:
+                    yield (''.join(buffer), child.value)
+                if child.children:
+                    stack.append(child_nodes(child))
+                    break
+                buffer.pop()
+            else:
+                stack.pop()
+                if stack:
+                    buffer.pop()
+
+    def __iter__(self):
+        """
+        Generator of (key, value) pairs for all keys below this position.
+        """
+        return self._walk(False)
+
+    def iter_items(self, prefix='', ordered=False):
+        """
+        Generator of (key, value) pairs for all keys that start with prefix
+        (including prefix itself), optionally in lexicographic order.
+        """
+        node = self.get_node(prefix)
+        if node is None:
+            return
+        if prefix and node.value is not None:
+            yield (prefix, node.value)
+        for key, value in node._walk(ordered):
+            yield (prefix + key, value)
+
+    def most_frequent(self, k):
+        """
+        Return a list of the k (key, value) pairs with the largest values
+        among this position and the keys below it, largest first, with keys
+        relative to this position.
+        """
+        items = iter(self)
+        if self.value is not None:
+            items = [('', self.value)] + list(items)
+        return heapq.nlargest(k, items, key=lambda x: x[1])
+
+class RadixPrefixTree(_RadixPosition):
+    """
+    Path-compressed prefix tree with the same mapping interface as
+    PrefixTree.  Chains of nodes that have a single child and no value are
+    stored as one edge labelled with the whole substring, so long word tails
+    cost one node instead of one node per character.  Edges are split when a
+    new key branches off partway along them, and merged again when a
+    deletion leaves a node with no value and a single child.
+    """
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__(_RadixNode(''), 0)
+
+    def __setitem__(self, key, value):
+        """
+        Add a key with the given value to the prefix tree, or reassign the
+        associated value if it is already present.  Raise a TypeError if the
+        given key is not a string.
+        """
+        if not isinstance(key, str):
+            raise TypeError
+        if len(key) == 0:
+            raise KeyError
+
+        node = self._node
+        i = 0
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None:
+                node.children[key[i]] = _RadixNode(key[i:], value)
+                return
+            label = child.label
+            length = min(len(label), len(key) - i)
+            j = 0
+            while j < length and label[j] == key[i + j]:
+                j += 1
+            if j < len(label):
+                # key leaves (or ends) partway along the edge: split it
+                middle = _RadixNode(label[:j])
+                child.label = label[j:]
+                middle.children[child.label[0]] = child
+                node.children[key[i]] = middle
+                child = middle
+            node = child
+            i += j
+        node.value = value
+
+    def __delitem__(self, key):
+        """
+        Delete the given key from the prefix tree if it exists. If the given
+        key is not in the prefix tree, raise a KeyError.  If the given key is
+        not a string, raise a TypeError.
+        """
+        if not isinstance(key, str):
+            raise TypeError
+        if len(key) == 0:
+            raise KeyError
+
+        parents = []
+        node = self._node
+        i = 0
+        while i < len(key):
+            parents.append(node)
+            node = node.children.get(key[i])
+            if node is None or not key.startswith(node.label, i):
+                raise KeyError
+            i += len(node.label)
+        if node.value is None:
+            raise KeyError
+        node.value = None
+
+        parent = parents.pop()
+        if not node.children:
+            del parent.children[node.label[0]]
+            # the parent may now be a valueless node with a single child
+            if parents and parent.value is None and len(parent.children) == 1:
+                node, parent = parent, parents.pop()
+            else:
+                return
+        if len(node.children) == 1:
+            child, = node.children.values()
+            child.label = node.label + child.label
+            parent.children[child.label[0]] = child
+
+def count_words(text, word_dict):
+    """
+    Tokenize text and add the number of occurrences of each word to
+    word_dict (a dict mapping words to their frequencies), in place.
+    """
+    for t in tokenize_sentences(text):
         for word in t.split():
             if word not in word_dict:
                 word_dict[word] = 1
             else:
                 word_dict[word] += 1
 
+def word_frequencies(text):
+    """
+    Given a piece of text as a single string, create a prefix tree whose keys
+    are the words in the text, and whose values are the number of times the
+    associated word appears in the text.
+    """
+    word_dict = {} # a dict mapping words to their frequencies
+    count_words(text, word_dict)
+
     word_tree = PrefixTree()
     for w, f in word_dict.items():
         word_tree[w] = f
-    return word_tree   
+    return word_tree
+
+def read_chunks(filename, chunk_size=1 << 20):
+    """
+    Generator of pieces of the text in the given file, each roughly
+    chunk_size characters long.  Every piece ends on whitespace, so no word
+    is ever split between two pieces; the partial word at the end of a read
+    is carried over into the next piece.
+    """
+    carry = ''
+    with open(filename, encoding="utf-8") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            data = carry + data
+            cut = max(data.rfind(c) for c in ' \t\n\r')
+            if cut == -1:
+                carry = data
+                continue
+            carry = data[cut + 1:]
+            yield data[:cut + 1]
+    if carry:
+        yield carry
+
+def file_segments(filename, size):
+    """
+    Generator of (start, end) byte offsets that split the given file into
+    pieces of roughly size bytes.  Every piece but the last ends just after a
+    space, tab or newline byte; these bytes never occur inside a multi-byte
+    UTF-8 character, so no word or character is split between two pieces.
+    """
+    total = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        start = 0
+        while start < total:
+            end = start + size
+            if end >= total:
+                yield start, total
+                return
+            f.seek(end)
+            while True:
+                block = f.read(4096)
+                if not block:
+                    end = total
+                    break
+                cuts = [i for i in (block.find(c) for c in b' \t\n') if i != -1]
+                if cuts:
+                    end += min(cuts) + 1
+                    break
+                end += len(block)
+            yield start, end
+            start = end
+
+def _count_segment(args):
+    """
+    Worker for word_frequencies_from_files: return a dict mapping the words in
+    one segment of a file (as given by file_segments) to their frequencies.
+    """
+    filename, start, end = args
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # same newline handling as reading the file in text mode
+    text = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+    word_dict = {}
+    count_words(text, word_dict)
+    return word_dict
+
+def word_frequencies_from_files(filenames, chunk_size=1 << 20,
+                                max_pending=100000, processes=None):
+    """
+    Build the same prefix tree as word_frequencies over the concatenated text
+    of several files, without ever holding a whole file in memory.
+
+    Files are read in chunks of chunk_size characters.  Counts are collected
+    in a dict that is merged into the tree whenever it holds more than
+    max_pending distinct words, which bounds the extra memory used on top of
+    the tree itself.
+
+    If processes is given, the files are cut into segments of about
+    chunk_size bytes (see file_segments) that are counted in parallel by a
+    pool of that many worker processes.  Each worker sends back the counts
+    for one segment, which are merged into the tree right away, and at most
+    two segments per process are queued at a time.  So here it is chunk_size,
+    not max_pending, that bounds the size of the pending counts, and large
+    files are spread over all of the workers.
+    """
+    word_tree = PrefixTree()
+
+    def merge(word_dict):
+        for w, f in word_dict.items():
+            word_tree.increment(w, f)
+
+    if processes is not None:
+        with multiprocessing.Pool(processes) as pool:
+            pending = collections.deque()
+            for filename in filenames:
+                for start, end in file_segments(filename, chunk_size):
+                    if len(pending) >= 2 * processes:
+                        merge(pending.popleft().get())
+                    pending.append(pool.apply_async(_count_segment, ((filename, start, end),)))
+            while pending:
+                merge(pending.popleft().get())
+        return word_tree
+
+    word_dict = {}
+    for filename in filenames:
+        for chunk in read_chunks(filename, chunk_size):
+            count_words(chunk, word_dict)
+            if len(word_dict) > max_pending:
+                merge(word_dict)
+                word_dict = {}
+    merge(word_dict)
+    return word_tree
 
 def autocomplete(tree, prefix, max_count=None):
     """
@@ -170,93 +1041,265 @@ def autocomplete(tree, prefix, max_count=None):
     if not isinstance(prefix, str):
         raise TypeError
 
-    if max_count is not None and max_count <= 0:
-        return []
-
-    subtree = tree.get_node(prefix)
+    return _completions(tree.get_node(prefix), prefix, max_count)
 
-    if subtree == None:
+def _completions(subtree, prefix, max_count):
+    """
+    The body of autocomplete, given the node subtree that prefix leads to
+    (None if there is none).
+    """
+    if subtree is None:
         return []
 
-    try:
-        result_list = [(prefix, tree[prefix])]
-    except:
-        result_list = []
+    if max_count is not None:
+        if max_count <= 0:
+            return []
+        return [prefix + key for key, _ in subtree.most_frequent(max_count)]
 
-    for k, val in subtree:
-        result_list.append((prefix + k, val))
+    result_list = [(prefix + key, value) for key, value in subtree]
+    if prefix and subtree.value is not None:
+        result_list.append((prefix, subtree.value))
     result_list.sort(reverse = True, key = lambda x: x[1])
+    return [word for word, _ in result_list]
 
-    if max_count is None or max_count > len(result_list):
-        return [word for word, _ in result_list]
-    else:
-        return [result_list[i][0] for i in range(max_count)]
+def autocomplete_batch(tree, prefixes, max_count=None):
+    """
+    Return a dict mapping each of the given prefixes to autocomplete(tree,
+    prefix, max_count).
 
-def autocorrect(tree, prefix, max_count=None):
+    The prefixes are handled in sorted order while keeping the path of nodes
+    for the previous prefix, so a prefix that shares its first characters
+    with the previous one (e.g. "ap" after "a") only walks the characters
+    that differ instead of starting again from the root.
+    """
+    result = {}
+    previous = ''
+    path = [tree]  # path[i] is the node for previous[:i], or None
+    for prefix in sorted(set(prefixes)):
+        if not isinstance(prefix, str):
+            raise TypeError
+        common = 0
+        while (common < len(prefix) and common < len(previous)
+               and prefix[common] == previous[common]):
+            common += 1
+        del path[common + 1:]
+        for char in prefix[common:]:
+            node = path[-1]
+            path.append(None if node is None else node.get_node(char))
+        previous = prefix
+        result[prefix] = _completions(path[-1], prefix, max_count)
+    return result
+
+class AutocompleteSession:
+    """
+    Incremental autocomplete for a prefix that is typed one character at a
+    time.  The session keeps the node for every prefix typed so far, so
+    extending the prefix by one character is a single child lookup and
+    backspacing is free.
+
+       session = AutocompleteSession(tree, 5)
+       session.extend('ap')
+       session.results()   # same as autocomplete(tree, 'ap', 5)
+    """
+    def __init__(self, tree, max_count=None):
+        self.tree = tree
+        self.max_count = max_count
+        self.prefix = ''
+        self._path = [tree]  # self._path[i] is the node for prefix[:i]
+
+    def extend(self, text):
+        """
+        Append the characters of text to the current prefix.
+        """
+        if not isinstance(text, str):
+            raise TypeError
+        for char in text:
+            node = self._path[-1]
+            self._path.append(None if node is None else node.get_node(char))
+        self.prefix += text
+
+    def backspace(self, count=1):
+        """
+        Remove the last count characters from the current prefix.
+        """
+        count = min(count, len(self.prefix))
+        if count > 0:
+            del self._path[-count:]
+            self.prefix = self.prefix[:-count]
+
+    def results(self):
+        """
+        Return autocomplete(tree, prefix, max_count) for the current prefix.
+        """
+        return _completions(self._path[-1], self.prefix, self.max_count)
+
+def words_within_distance(tree, word, max_edits=1):
+    """
+    Return a list of (key, value) pairs for all keys in the given prefix tree
+    that can be turned into word by at most max_edits single-character
+    insertions, deletions, replacements or swaps of adjacent characters
+    (optimal string alignment distance).  The word itself is included if it
+    is a key.
+
+    Rather than generating every candidate edit and looking each one up from
+    the root, this walks the tree along word and branches into an edit only
+    where the tree actually has a matching branch: an insertion or
+    replacement follows one of the existing children, a deletion skips a
+    character of word, and a swap follows the two swapped characters.  Each
+    state is (node, characters of word consumed, edits left); since the key
+    determines the node, states are remembered by key so that different edit
+    sequences reaching the same state are only explored once.
+    """
+    n = len(word)
+    found = {}
+    seen = set()
+    stack = [(tree, '', 0, max_edits)]
+    while stack:
+        node, key, i, edits = stack.pop()
+        if (key, i, edits) in seen:
+            continue
+        seen.add((key, i, edits))
+
+        if i == n:
+            if node.value is not None and key:
+                found[key] = node.value
+        else:
+            child = node.children.get(word[i])
+            if child is not None:
+                stack.append((child, key + word[i], i + 1, edits))
+
+        if edits == 0:
+            continue
+        if i < n:
+            # delete word[i]
+            stack.append((node, key, i + 1, edits - 1))
+        for char, child in node.children.items():
+            # insert char before word[i]
+            stack.append((child, key + char, i, edits - 1))
+            if i < n and char != word[i]:
+                # replace word[i] with char
+                stack.append((child, key + char, i + 1, edits - 1))
+        if i + 1 < n and word[i] != word[i + 1]:
+            # swap word[i] and word[i + 1]
+            child = node.children.get(word[i + 1])
+            if child is not None:
+                child = child.children.get(word[i])
+                if child is not None:
+                    stack.append((child, key + word[i + 1] + word[i], i + 2, edits - 1))
+    return list(found.items())
+
+def autocorrect(tree, prefix, max_count=None, max_edits=1):
     """
     Return the list of the most-frequent words that start with prefix or that
     are valid words that differ from prefix by a small edit.  Include up to
     max_count elements from the autocompletion.  If autocompletion produces
     fewer than max_count elements, include the most-frequently-occurring valid
     edits of the given word as well, up to max_count total elements.
+
+    max_edits (1 or 2) is the largest number of single-character edits
+    allowed between prefix and a suggested word.
     """
     autofill_list = autocomplete(tree, prefix, max_count)
-    alphabet = "abcdefghijklmnopqrstuvwxyz"
     if max_count is not None and len(autofill_list) == max_count:
         return autofill_list
     autofill_set = set(autofill_list)
-    def insert_char():
-        result = []
-        for i in range(26):
-            for j in range(len(prefix) + 1):
-                word = prefix[:j] + alphabet[i] + prefix[j:]
-                if word in tree:
-                    result.append((word, tree[word]))
-        return result
 
-    def del_char():
-        result = []
-        for i in range(len(prefix)):
-            word = prefix[:i] + prefix[i+1:]
-            if word in tree:
-                result.append((word, tree[word]))
-        return result
-    
-    def replace_char():
-        result = []
-        for i in range(26):
-            for j in range(len(prefix) + 1):
-                word = prefix[:j] + alphabet[i] + prefix[j+1:]
-                if word in tree:
-                    result.append((word, tree[word]))
-        return result
-
-    def transpose():
-        result = []
-        n = len(prefix)
-
-        for i in range(n - 2):
-            word = prefix[:i] + prefix[i + 1] + prefix[i] + prefix[i+2:]
-            if word in tree:
-                result.append((word, tree[word]))
-        if n >= 2:
-            word1 = prefix[:n - 2] + prefix[n - 1] + prefix[n - 2]
-        if word1 in tree:
-            result.append((word1, tree[word1]))
-        return result
+    full_list = words_within_distance(tree, prefix, max_edits)
 
-    full_list =  insert_char() + del_char() + replace_char() + transpose()   
-    
     if max_count is None:
         return list(autofill_set | {word for word, _ in full_list})
     else:
         full_list.sort(reverse = True, key = lambda x: x[1])
-        while len(autofill_list) != max_count:
-            x, _ = full_list.pop(0)
-            if x not in autofill_set:
-                autofill_list.append(x)
-                autofill_set.add(x)
-        return autofill_list            
+        for word, _ in full_list:
+            if len(autofill_list) == max_count:
+                break
+            if word not in autofill_set:
+                autofill_list.append(word)
+                autofill_set.add(word)
+        return autofill_list
+
+class WordPattern:
+    """
+    A word_filter pattern compiled into a deterministic automaton.
+
+    The pattern is first read as a nondeterministic automaton whose states
+    are positions in the pattern: a literal or ? moves to the next position,
+    and a * may either stay put (consuming a character) or be skipped.  Sets
+    of positions are then turned into deterministic states lazily, the first
+    time they are reached, and every (state, character) transition is cached.
+    Matching a tree therefore costs one dictionary lookup per node visited,
+    however many *s the pattern has.
+    """
+    __slots__ = ('pattern', 'start', '_states', '_positions', '_transitions',
+                 '_accepting', '_match_all')
+
+    def __init__(self, pattern):
+        if not isinstance(pattern, str):
+            raise TypeError
+        # consecutive *s are equivalent to a single *
+        collapsed = []
+        for char in pattern:
+            if char != '*' or not collapsed or collapsed[-1] != '*':
+                collapsed.append(char)
+        self.pattern = ''.join(collapsed)
+        self._states = {}  # frozenset of pattern positions -> state number
+        self._positions = []  # state number -> frozenset of pattern positions
+        self._transitions = {}  # (state number, char) -> state number
+        self._accepting = []  # state number -> does it accept?
+        self._match_all = []  # state number -> does it accept every suffix?
+        self.start = self._state({0})
+
+    def _state(self, positions):
+        """
+        Return the state number for a set of pattern positions, after adding
+        the positions reachable by skipping *s.  The empty set (no possible
+        match) is always state -1.
+        """
+        pattern = self.pattern
+        closure = set()
+        for i in positions:
+            while i < len(pattern) and pattern[i] == '*' and i not in closure:
+                closure.add(i)
+                i += 1
+            closure.add(i)
+        if not closure:
+            return -1
+        positions = frozenset(closure)
+        if positions not in self._states:
+            self._states[positions] = len(self._positions)
+            self._positions.append(positions)
+            self._accepting.append(len(pattern) in positions)
+            self._match_all.append(
+                len(pattern) - 1 in positions and pattern[-1] == '*')
+        return self._states[positions]
+
+    def step(self, state, char):
+        """
+        Return the state reached from state by reading char (-1 if no word
+        with this prefix can match).
+        """
+        result = self._transitions.get((state, char))
+        if result is None:
+            pattern = self.pattern
+            following = set()
+            for i in self._positions[state]:
+                if i < len(pattern):
+                    if pattern[i] == '*':
+                        following.add(i)
+                    elif pattern[i] == '?' or pattern[i] == char:
+                        following.add(i + 1)
+            result = self._transitions[(state, char)] = self._state(following)
+        return result
+
+    def accepts(self, state):
+        return state != -1 and self._accepting[state]
+
+    def matches_all(self, state):
+        """
+        Does every string (including the empty one) take state to a match?
+        This is the case once only a trailing * is left in the pattern.
+        """
+        return state != -1 and self._match_all[state]
 
 def word_filter(tree, pattern):
     """
@@ -265,63 +1308,31 @@ def word_filter(tree, pattern):
          * matches any sequence of zero or more characters,
          ? matches any single character,
          otherwise char in pattern char must equal char in word.
-    """
-    n = len(pattern)
-    for i in range(len(pattern)):
-        if n - 2 - i >= 0:
-            if pattern[n - 1 - i] == '*' and pattern[n - 2 - i] == '*':
-                pattern = pattern[:n - 2 - i] + pattern[n - 1 - i:]
-
-    def recursion_helper(result, pat):
-        if len(pat) == 0:
-            result_list = []
-            for word in result:
-                if word in tree:
-                    result_list.append((word, tree[word]))
-            return result_list
 
-        else:
-            def edit_new_list(node, seg, char):
-                if char != '*' and char != '?':
-                    if char in node.children:
-                        new_list.append(seg + char)
-                if char == '?':
-                    for letter in node.children:
-                        new_list.append(seg + letter)
-                if char == '*':
-                    new_list.append(seg)
-                    if len(pat) == 1:
-                        for frag, _ in node:
-                            new_list.append(seg + frag)
-                    else:
-                        for frag in valid_fragments(node):
-                            new_list.append(seg + frag)
-
-            def valid_fragments(node):
-                # return a generator of all valid word fragments in a node for * not at the end of the pattern
-
-                for child, tree in node.children.items():
-                    if len(tree.children) != 0:
-                        yield child
-
-                        for key in valid_fragments(tree):
-                            yield (child + key)                        
-
-            new_list = []
-            char = pat[0]
-            if len(result) == 0:
-                node = tree
-                seg = ''
-                edit_new_list(node, seg, char)
-            
-            else:
-                for seg in result:
-                    node = tree.get_node(seg)
-                    edit_new_list(node, seg, char)
-            
-            return recursion_helper(new_list, pat[1:])
+    pattern may also be an already compiled WordPattern, which is useful when
+    the same pattern is matched against many trees.
+    """
+    if not isinstance(pattern, WordPattern):
+        pattern = WordPattern(pattern)
 
-    return list(set(recursion_helper([], pattern)))
+    result = []
+    # walk the tree and the automaton together; each node is visited once,
+    # and branches where the automaton has no possible match are skipped
+    stack = [(tree, '', pattern.start)]
+    while stack:
+        node, key, state = stack.pop()
+        if key and node.value is not None and pattern.accepts(state):
+            result.append((key, node.value))
+        if pattern.matches_all(state):
+            # only a trailing * is left, so the whole subtree matches
+            for suffix, value in node:
+                result.append((key + suffix, value))
+            continue
+        for char, child in node.children.items():
+            next_state = pattern.step(state, char)
+            if next_state != -1:
+                stack.append((child, key + char, next_state))
+    return result
 
 '''
 with open("a_tale_of_two_cities.txt", encoding="utf-8") as f:
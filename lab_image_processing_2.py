@@ -2,17 +2,36 @@
 
 # NO ADDITIONAL IMPORTS!
 # (except in the last part of the lab; see the lab writeup for details)
+import argparse
+import bisect
+import concurrent.futures
+import concurrent.futures.process
+import json
 import math
+import multiprocessing
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
 from PIL import Image
 
+# NumPy is optional: the filters use it when it is installed
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 # VARIOUS FILTERS
 
 def get_pixel(image, x, y, boundary_behavior):
     '''
     Access the values of the pixels that are both in and out of range of the image depending on the boundary behavior
-    For pixels that are out of range, the function goes through 8 possible cases (a combination of x/y having negative indices,
-    indices greater than the width/height, and indices within range of the image) for each boundary behavior.
+    For pixels that are out of range with the 'extend' behavior, the function goes through 8 possible cases (a combination of x/y
+    having negative indices, indices greater than the width/height, and indices within range of the image); with 'wrap', both
+    coordinates are simply reduced modulo the height/width.
     For pixels within range, With x as the position of the pixel along the height and y as the position of the pixel along the width, 
     the pixel's corresponding index is width*x + y. 
 
@@ -41,34 +60,8 @@ def get_pixel(image, x, y, boundary_behavior):
                 return image['pixels'][len(image['pixels']) - 1]
                     
         if boundary_behavior == 'wrap':
-            if x < 0 and y < 0:
-                x = image['height'] - (-x)%image['height']
-                y = image['width'] - (-y)%image['width']
-                get_pixel(image, x, y, None)
-            elif x < 0 and y >= 0 and y < image['width']:
-                x = image['height'] - (-x)%image['height']
-                get_pixel(image, x, y, None)
-            elif x < 0 and y >= image['width']:
-                x = image['height'] - (-x)%image['height']
-                y = y%image['width']
-                get_pixel(image, x, y, None)
-            elif x >= 0 and x < image['height'] and y < 0:
-                y = image['width'] - (-y)%image['width']
-                get_pixel(image, x, y, None)
-            elif x >= 0 and x < image['height'] and y >= image['width']:
-                y = y%image['width']
-                get_pixel(image, x, y, None)
-            elif x >= image['height'] and y < 0:
-                x = x%image['height']
-                y = image['width'] - (-y)%image['width']
-                get_pixel(image, x, y, None)
-            elif x >= image['height'] and y >= 0 and y < image['width']:
-                x = x%image['height']
-                get_pixel(image, x, y, None)
-            elif x >= image['height'] and y >= image['width']:
-                x = x%image['height']
-                y = y%image['width']
-                get_pixel(image, x, y, None)
+            x = x % image['height']
+            y = y % image['width']
 
     return image['pixels'][image['width']*x + y]
 
@@ -76,21 +69,402 @@ def set_pixel(image, x, y, c):
     image['pixels'][image['width']*x + y] = c
 
 def apply_per_pixel(image, func, boundary_behavior):
-    result = {
+    '''
+    Return a new image with func applied to every pixel.  When the pixels are
+    all integers in [0, 255], func is instead evaluated once for each of the
+    256 possible values and the resulting lookup table is applied to the whole
+    image (see apply_lookup_table), so func should not depend on anything but
+    its argument.
+    '''
+    result = _byte_lookup(image, func)
+    if result is not None:
+        return result
+
+    return {
         'height': image['height'],
         'width': image['width'],
-        'pixels': [],
+        'pixels': [func(color) for color in image['pixels']],
     }
-    for x in range(image['height']):
-        for y in range(image['width']):
-            color = get_pixel(image, x, y, boundary_behavior)
-            newcolor = func(color)
-            result['pixels'].append(newcolor)
-    return result
 
 def inverted(image):
     return apply_per_pixel(image, lambda c: 255-c, None)
 
+# POINT OPERATIONS
+
+def lookup_table(func):
+    '''
+    Return the list [func(0), func(1), ..., func(255)].
+    '''
+    return [func(c) for c in range(256)]
+
+def make_point_filter(func):
+    '''
+    Return a filter applying func to every pixel of an image whose pixels are
+    integers in [0, 255], with func compiled into a lookup table once, when
+    the filter is made.
+    '''
+    table = lookup_table(func)
+
+    def point_filtered(image):
+
+        return apply_lookup_table(image, table)
+
+    return point_filtered
+
+def apply_lookup_table(image, table):
+    '''
+    Return a new image in which every pixel p (an integer in [0, 255]) is
+    replaced with table[p].  If the table's entries are integers in [0, 255]
+    as well, a list of pixels is mapped all at once with bytes.translate, and
+    an array of pixels with NumPy indexing.
+    '''
+    pixels = image['pixels']
+    byte_table = all(type(v) is int and 0 <= v <= 255 for v in table)
+
+    if is_array_image(image):
+        new_pixels = np.asarray(table, dtype=np.uint8 if byte_table else None)[pixels]
+    elif byte_table:
+        new_pixels = list(bytes(pixels).translate(bytes(table)))
+    else:
+        new_pixels = [table[p] for p in bytes(pixels)]
+    return {'height': image['height'], 'width': image['width'], 'pixels': new_pixels}
+
+def _byte_lookup(image, func):
+    # apply_lookup_table(image, lookup_table(func)), or None if the pixels
+    # are not all integers in [0, 255]
+    pixels = image['pixels']
+    if is_array_image(image):
+        if not _is_byte_array(pixels):
+            return None
+    else:
+        try:
+            bytes(pixels)
+        except (TypeError, ValueError):
+            return None
+    return apply_lookup_table(image, lookup_table(func))
+
+# NUMPY BACKEND
+
+# np.pad modes matching each boundary behavior
+PAD_MODES = {'zero': 'constant', 'extend': 'edge', 'wrap': 'wrap'}
+
+def array_image(image):
+    '''
+    Return a copy of the given greyscale image whose 'pixels' are a flat NumPy
+    array instead of a list.  The filters accept these images as well and keep
+    their results as arrays, so a whole pipeline can run without converting
+    back to lists.  Requires NumPy.
+    '''
+    return {'height': image['height'], 'width': image['width'], 'pixels': np.array(image['pixels'])}
+
+def list_image(image):
+    '''
+    Return a copy of the given image with its 'pixels' as a list (undoing
+    array_image).
+    '''
+    pixels = image['pixels']
+    if np is not None and isinstance(pixels, np.ndarray):
+        pixels = pixels.tolist()
+    else:
+        pixels = list(pixels)
+    return {'height': image['height'], 'width': image['width'], 'pixels': pixels}
+
+def is_array_image(image):
+    return np is not None and isinstance(image['pixels'], np.ndarray)
+
+def _is_byte_array(pixels):
+    # whether the given array holds only integers in [0, 255]
+    return pixels.dtype.kind in 'iu' and not (pixels.size and (pixels.min() < 0 or pixels.max() > 255))
+
+def correlate_array(pixels, kernel, boundary_behavior):
+    '''
+    Correlate a 2-D NumPy array with the given kernel (a list, as in
+    correlate), returning a 2-D float array of the same shape.
+
+    The array is padded once according to the boundary behavior, and then
+    every kernel entry adds a shifted view of the padded array times its
+    weight to the result.  The terms are added in the same order as in the
+    pure-Python correlate, so the results are identical.
+    '''
+    height, width = pixels.shape
+    side_length = int(math.sqrt(len(kernel)))
+    mid_length = side_length//2
+
+    padded = np.pad(np.asarray(pixels, dtype=float), mid_length, mode=PAD_MODES[boundary_behavior])
+    result = np.zeros((height, width))
+    for j in range(side_length):
+        for k in range(side_length):
+            weight = kernel[side_length*j + k]
+            if weight:
+                result += weight * padded[j:j + height, k:k + width]
+    return result
+
+# kernels at least this wide are correlated with the FFT (see correlate_fft)
+FFT_MIN_SIZE = 15
+
+def correlate_fft(pixels, kernel, boundary_behavior):
+    '''
+    Same as correlate_array, but computed with NumPy's FFT, so the work per
+    pixel grows with the logarithm of the image size instead of with n**2
+    for an n by n kernel.
+
+    The array is padded exactly as in correlate_array, so every boundary
+    behavior is handled by the padding, and the padded array is convolved
+    with the flipped kernel.  The FFT size is at least the padded size, so
+    the output pixels never see the circular wrap-around.  The results agree
+    with the direct method to within floating-point rounding (about 1e-12
+    relative); if the kernel and the pixels are all integers, the exact
+    integer results are recovered by rounding.  Otherwise results lying
+    (nearly) halfway between two integers are recomputed the way the direct
+    method does, as in correlate_separable, so that round_and_clip_image
+    gives exactly the same output.
+    '''
+    height, width = pixels.shape
+    side_length = int(math.sqrt(len(kernel)))
+    mid_length = side_length//2
+
+    padded = np.pad(np.asarray(pixels, dtype=float), mid_length, mode=PAD_MODES[boundary_behavior])
+    flipped = np.asarray(kernel, dtype=float).reshape(side_length, side_length)[::-1, ::-1]
+    shape = tuple(_fft_size(s) for s in padded.shape)
+    product = np.fft.rfft2(padded, shape) * np.fft.rfft2(flipped, shape)
+    full = np.fft.irfft2(product, shape)
+    result = full[side_length - 1:side_length - 1 + height, side_length - 1:side_length - 1 + width]
+
+    if np.issubdtype(np.asarray(pixels).dtype, np.integer) and all(float(w).is_integer() for w in kernel):
+        return np.rint(result)
+    result = np.ascontiguousarray(result)
+    if result.size:
+        tolerance = _tie_tolerance(float(np.abs(padded).max()), kernel)
+        for x, y in zip(*np.nonzero(np.abs(result % 1 - 0.5) <= tolerance)):
+            result[x, y] = _direct_correlation(padded[x:x + side_length, y:y + side_length].ravel().tolist(), kernel)
+    return result
+
+def _fft_size(n):
+    # the smallest 2**a * 3**b * 5**c that is at least n (FFTs of these sizes are fast)
+    best = 1
+    while best < n:
+        best *= 2
+    odd3 = 1
+    while odd3 < best:
+        odd = odd3
+        while odd < best:
+            size = odd
+            while size < n:
+                size *= 2
+            best = min(best, size)
+            odd *= 5
+        odd3 *= 3
+    return best
+
+# SEPARABLE KERNELS AND BOX BLURS
+
+# kernels at least this wide are checked for separability by correlate
+SEPARABLE_MIN_SIZE = 5
+
+def padded_rows(image, pad, boundary_behavior):
+    '''
+    Return the pixels of the given image as a list of rows, with pad extra
+    pixels on every side filled in according to boundary_behavior ('zero',
+    'extend' or 'wrap').  Out-of-range coordinates are mapped with plain index
+    arithmetic once per row and column, so correlating over the result needs
+    no bounds checks.
+    '''
+    height, width = image['height'], image['width']
+    pixels = image['pixels']
+
+    def source(i, size):
+        # index of the pixel that coordinate i refers to, or None for zero
+        if boundary_behavior == 'extend':
+            return min(max(i, 0), size - 1)
+        if boundary_behavior == 'wrap':
+            return i % size
+        return i if 0 <= i < size else None
+
+    columns = [source(y, width) for y in range(-pad, width + pad)]
+    zero_row = [0] * (width + 2*pad)
+    rows = []
+    for x in range(-pad, height + pad):
+        source_row = source(x, height)
+        if source_row is None:
+            rows.append(zero_row)
+            continue
+        start = width*source_row
+        rows.append([0 if y is None else pixels[start + y] for y in columns])
+    return rows
+
+def separable_kernel(kernel):
+    '''
+    If the given kernel is the outer product of a column and a row (as box
+    blurs are), return the pair (column, row) of lists; otherwise return
+    None.  Only exact factorizations are accepted, so that correlating with
+    the column and then the row reproduces every kernel entry exactly.
+    '''
+    side_length = int(math.sqrt(len(kernel)))
+    pivot = max(range(len(kernel)), key=lambda i: abs(kernel[i]))
+    if kernel[pivot] == 0:
+        return None
+    pivot_row, pivot_column = divmod(pivot, side_length)
+
+    row = kernel[side_length*pivot_row:side_length*(pivot_row + 1)]
+    column = [kernel[side_length*j + pivot_column] / kernel[pivot] for j in range(side_length)]
+    for j in range(side_length):
+        for k in range(side_length):
+            if column[j] * row[k] != kernel[side_length*j + k]:
+                return None
+    return column, row
+
+def correlate_separable(image, column, row, boundary_behavior):
+    '''
+    Correlate the given image with the kernel whose entries are
+    column[j] * row[k], as two 1-D passes: first each (padded) row with row,
+    then each column of the result with column.  This costs 2n instead of
+    n**2 multiplications per pixel for an n by n kernel.
+
+    The two passes add the terms up in a different order than the direct
+    method, so results can differ from it by a few units in the last place.
+    That only matters for rounding when a result lies (nearly) halfway
+    between two integers; those pixels are recomputed the way the direct
+    method does, so round_and_clip_image gives exactly the same output.
+    '''
+    height, width = image['height'], image['width']
+    side_length = len(row)
+    mid_length = side_length//2
+
+    if np is not None:
+        pixels = np.asarray(image['pixels'], dtype=float).reshape(height, width)
+        padded = np.pad(pixels, mid_length, mode=PAD_MODES[boundary_behavior])
+        horizontal = np.zeros((padded.shape[0], width))
+        for k, weight in enumerate(row):
+            if weight:
+                horizontal += weight * padded[:, k:k + width]
+        result = np.zeros((height, width))
+        for j, weight in enumerate(column):
+            if weight:
+                result += weight * horizontal[j:j + height]
+        if result.size:
+            kernel = [c * r for c in column for r in row]
+            tolerance = _tie_tolerance(float(np.abs(padded).max()), kernel)
+            for x, y in zip(*np.nonzero(np.abs(result % 1 - 0.5) <= tolerance)):
+                result[x, y] = _direct_correlation(padded[x:x + side_length, y:y + side_length].ravel().tolist(), kernel)
+        result = result.ravel()
+        if not is_array_image(image):
+            result = result.tolist()
+        return {'height': height, 'width': width, 'pixels': result}
+
+    padded = padded_rows(image, mid_length, boundary_behavior)
+    horizontal = []
+    for padded_row in padded:
+        acc = [0] * width
+        for k, weight in enumerate(row):
+            if weight:
+                acc = [a + weight*p for a, p in zip(acc, padded_row[k:k + width])]
+        horizontal.append(acc)
+
+    result = []
+    for x in range(height):
+        acc = [0] * width
+        for j, weight in enumerate(column):
+            if weight:
+                acc = [a + weight*p for a, p in zip(acc, horizontal[x + j])]
+        result.extend(acc)
+
+    if result:
+        kernel = [c * r for c in column for r in row]
+        tolerance = _tie_tolerance(max(abs(p) for padded_row in padded for p in padded_row), kernel)
+        for i, value in enumerate(result):
+            if abs(value % 1 - 0.5) <= tolerance:
+                x, y = divmod(i, width)
+                window = [p for padded_row in padded[x:x + side_length] for p in padded_row[y:y + side_length]]
+                result[i] = _direct_correlation(window, kernel)
+    return {'height': height, 'width': width, 'pixels': result}
+
+def _tie_tolerance(largest_pixel, kernel):
+    # a bound on how far two different summation orders of the same
+    # correlation can drift apart, with a wide margin
+    return 1e-9 * max(1.0, largest_pixel * sum(abs(weight) for weight in kernel))
+
+def _direct_correlation(window, kernel):
+    # the sum correlate's direct method computes for one pixel, adding the
+    # terms in the same order and skipping zero weights
+    total = 0
+    for weight, p in zip(kernel, window):
+        if weight:
+            total += weight*p
+    return total
+
+def box_blurred(image, n, boundary_behavior='extend'):
+    '''
+    Return round_and_clip_image(correlate(image, kernel, boundary_behavior))
+    for the n by n box blur kernel, in constant time per pixel whatever n is.
+
+    Window sums are read off a summed-area table (integral image) of the
+    padded image with four lookups each.  For integer pixels the sums are
+    exact, and the exact average differs from the one correlate accumulates
+    in floating point by far less than the distance to the nearest rounding
+    boundary, except when the average lies exactly halfway between two
+    integers (only possible for even n).  Those pixels are recomputed the way
+    correlate does, so the output matches the direct method exactly.  Images
+    with non-integer pixels fall back to correlate.
+    '''
+    height, width = image['height'], image['width']
+    area = n**2
+    weight = 1/n**2
+    mid_length = n//2
+
+    if np is not None:
+        pixels = np.asarray(image['pixels']).reshape(height, width)
+        if not np.issubdtype(pixels.dtype, np.integer):
+            return round_and_clip_image(correlate(image, [weight] * area, boundary_behavior))
+        padded = np.pad(pixels.astype(np.int64), mid_length, mode=PAD_MODES[boundary_behavior])
+        table = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1), dtype=np.int64)
+        table[1:, 1:] = padded.cumsum(0).cumsum(1)
+        sums = (table[n:n + height, n:n + width] - table[:height, n:n + width]
+                - table[n:n + height, :width] + table[:height, :width])
+        quotient, remainder = np.divmod(sums, area)
+        result = quotient + (2*remainder > area)
+        for x, y in zip(*np.nonzero(2*remainder == area)):
+            window = padded[x:x + n, y:y + n].ravel().tolist()
+            result[x, y] = round(_direct_sum(window, weight))
+        result = np.clip(result, 0, 255).astype(np.uint8).ravel()
+        if not is_array_image(image):
+            result = result.tolist()
+        return {'height': height, 'width': width, 'pixels': result}
+
+    if not all(isinstance(p, int) for p in image['pixels']):
+        return round_and_clip_image(correlate(image, [weight] * area, boundary_behavior))
+
+    padded = padded_rows(image, mid_length, boundary_behavior)
+    # table[i][j] is the sum of padded[:i][:j]
+    table = [[0] * (len(padded[0]) + 1)]
+    for padded_row in padded:
+        above = table[-1]
+        line = [0]
+        total = 0
+        for j, p in enumerate(padded_row):
+            total += p
+            line.append(above[j + 1] + total)
+        table.append(line)
+
+    result = []
+    for x in range(height):
+        top, bottom = table[x], table[x + n]
+        for y, s in enumerate([d - c - b + a for a, b, c, d in zip(top, top[n:], bottom, bottom[n:])][:width]):
+            quotient, remainder = divmod(s, area)
+            if 2*remainder == area:
+                window = [p for r in padded[x:x + n] for p in r[y:y + n]]
+                value = round(_direct_sum(window, weight))
+            else:
+                value = quotient + (2*remainder > area)
+            result.append(0 if value < 0 else 255 if value > 255 else value)
+    return {'height': height, 'width': width, 'pixels': result}
+
+def _direct_sum(window, weight):
+    # the sum correlate computes for one pixel of a box blur
+    total = 0
+    for p in window:
+        total += p * weight
+    return total
+
 def correlate(image, kernel, boundary_behavior):
     """
     Compute the result of correlating the given image with the given kernel.
@@ -116,28 +490,41 @@ def correlate(image, kernel, boundary_behavior):
     """
     if boundary_behavior != 'zero' and boundary_behavior != 'extend' and boundary_behavior != 'wrap':
         return None
-    
+
+    if int(math.sqrt(len(kernel))) >= SEPARABLE_MIN_SIZE:
+        factors = separable_kernel(kernel)
+        if factors is not None:
+            return correlate_separable(image, factors[0], factors[1], boundary_behavior)
+
+    if np is not None:
+        pixels = np.asarray(image['pixels']).reshape(image['height'], image['width'])
+        if int(math.sqrt(len(kernel))) >= FFT_MIN_SIZE:
+            result = correlate_fft(pixels, kernel, boundary_behavior).ravel()
+        else:
+            result = correlate_array(pixels, kernel, boundary_behavior).ravel()
+        if not is_array_image(image):
+            result = result.tolist()
+        return {'height': image['height'], 'width': image['width'], 'pixels': result}
+
     side_length = int(math.sqrt(len(kernel)))
     mid_length = side_length//2
 
-    pixels_applied_kernel = []
+    width = image['width']
+    padded = padded_rows(image, mid_length, boundary_behavior)
 
-    #iterate through each pixel and apply the kernel to it
-    for i in range(len(image['pixels'])):
-        #calculating x and y using the index relation found in get_pixel (i = image['width']*x + y)
-        x = i // image['width']
-        y = i % image['width']
+    pixels_applied_kernel = []
 
-        pixel_applied = 0
-        
-        #start from the first element of the kernel and append values to the total kernel value associated with a particular index
+    #compute one output row at a time: every kernel entry adds its weight times the matching slice of a padded row,
+    #so the per-pixel work is plain arithmetic with no boundary checks (terms are added in the same order as before)
+    for x in range(image['height']):
+        row_applied = [0] * width
         for j in range(side_length):
-            for k in range(side_length): 
-                x_index = x - mid_length + j
-                y_index = y - mid_length + k
-                pixel_applied += get_pixel(image, x_index, y_index, boundary_behavior) * kernel[side_length*j + k]
-        
-        pixels_applied_kernel.append(pixel_applied)
+            padded_row = padded[x + j]
+            for k in range(side_length):
+                weight = kernel[side_length*j + k]
+                if weight:
+                    row_applied = [a + weight*p for a, p in zip(row_applied, padded_row[k:k + width])]
+        pixels_applied_kernel.extend(row_applied)
 
     return {'height': image['height'], 'width': image['width'], 'pixels': pixels_applied_kernel}
     
@@ -153,23 +540,25 @@ def round_and_clip_image(image):
     255 in the output; and any locations with values lower than 0 in the input
     should have value 0 in the output.
     """
-    rounded_pixels = []
-
-    for pixel in image['pixels']:
+    if is_array_image(image):
+        rounded_pixels = np.clip(np.round(image['pixels']), 0, 255).astype(np.uint8)
+        return {'height': image['height'], 'width': image['width'], 'pixels': rounded_pixels}
+
+    try:
+        #pixels that are already integers in [0, 255] are left as they are
+        rounded_pixels = list(bytes(image['pixels']))
+    except (TypeError, ValueError):
         #set negative pixel values to zero; set pixel values above 255 to 255
-        if pixel < 0:
-            pixel = 0
-        elif pixel > 255:
-            pixel = 255
-        else:
-            pixel = round(pixel)
-        rounded_pixels.append(pixel)
+        rounded_pixels = [0 if pixel < 0 else 255 if pixel > 255 else round(pixel) for pixel in image['pixels']]
     return {'height': image['height'], 'width': image['width'], 'pixels': rounded_pixels}
 
 def split_image(image):
     '''
     Splits a colored image into its three components
     '''
+    if isinstance(image, PlanarImage):
+        return image.planes()
+
     red_pixels = []
     green_pixels = []
     blue_pixels = []
@@ -190,9 +579,16 @@ def color_filter_from_greyscale_filter(filt):
     Given a filter that takes a greyscale image as input and produces a
     greyscale image as output, returns a function that takes a color image as
     input and produces the filtered color image.
+
+    The returned filter also accepts a PlanarImage, in which case the
+    greyscale filter runs directly on its planes and a PlanarImage is
+    returned.
     """
     def split_colors_then_recombine_filtered(image):
 
+        if isinstance(image, PlanarImage):
+            return image.filtered(filt)
+
         colored_pixels_filtered = []
 
         red_image, green_image, blue_image = split_image(image)
@@ -205,7 +601,9 @@ def color_filter_from_greyscale_filter(filt):
             colored_pixels_filtered.append((red_image_filtered['pixels'][i], green_image_filtered['pixels'][i], blue_image_filtered['pixels'][i]))
         
         return {'height': image['height'], 'width': image['width'], 'pixels': colored_pixels_filtered}
-    
+
+    # lets filter_cascade see through the color wrapper
+    split_colors_then_recombine_filtered.greyscale_filter = filt
     return split_colors_then_recombine_filtered
 
 filter = color_filter_from_greyscale_filter(inverted)
@@ -215,21 +613,35 @@ def make_blur_filter(n):
     
     def blurred_filtered(image):
 
-        return round_and_clip_image(correlate(image, [(1/n**2)] * n**2, 'extend'))
+        return box_blurred(image, n, 'extend')
 
+    # the linear part of the filter, for filter_cascade
+    blurred_filtered.kernel = [(1/n**2)] * n**2
+    blurred_filtered.boundary_behavior = 'extend'
     return blurred_filtered
 
 
 def make_sharpen_filter(n):
-    
-    def sharpened_filtered(image):
 
-        kernel = [- (1/n**2)] * n**2
-        kernel[(n**2)//2] = 2 - (1/n**2)
+    kernel = [- (1/n**2)] * n**2
+    kernel[(n**2)//2] = 2 - (1/n**2)
+
+    return make_correlation_filter(kernel, 'extend')
+
+def make_correlation_filter(kernel, boundary_behavior='extend'):
+    """
+    Return a filter that correlates an image with the given kernel and then
+    rounds and clips the result.  The kernel and boundary behavior are kept as
+    attributes of the filter so that filter_cascade can combine it with its
+    neighbors.
+    """
+    def correlation_filtered(image):
 
-        return round_and_clip_image(correlate(image, kernel, 'extend'))
+        return round_and_clip_image(correlate(image, kernel, boundary_behavior))
 
-    return sharpened_filtered
+    correlation_filtered.kernel = kernel
+    correlation_filtered.boundary_behavior = boundary_behavior
+    return correlation_filtered
 
 def edges(image):
     """
@@ -238,6 +650,16 @@ def edges(image):
     """
     K_x = [-1, 0, 1, -2, 0, 2, -1, 0, 1]
     K_y = [-1, -2, -1, 0, 0, 0, 1, 2, 1]
+
+    if np is not None:
+        pixels = np.asarray(image['pixels']).reshape(image['height'], image['width'])
+        ox = correlate_array(pixels, K_x, 'extend')
+        oy = correlate_array(pixels, K_y, 'extend')
+        magnitude = np.clip(np.round(np.sqrt(ox*ox + oy*oy)), 0, 255).astype(np.uint8).ravel()
+        if not is_array_image(image):
+            magnitude = magnitude.tolist()
+        return {'height': image['height'], 'width': image['width'], 'pixels': magnitude}
+
     ox = correlate(image, K_x, 'extend')['pixels']    
     oy = correlate(image, K_y, 'extend')['pixels']
     image_edge_detection = []
@@ -249,43 +671,515 @@ def edges(image):
     return round_and_clip_image(new_image)
 
 
-def filter_cascade(filters_list):
+def filter_cascade(filters_list, fuse=False):
     """
     Given a list of filters (implemented as functions on images), returns a new
     single filter such that applying that filter to an image produces the same
     output as applying each of the individual ones in turn.
+
+    The list is planned once, when the cascade is built.  Runs of consecutive
+    color filters made by color_filter_from_greyscale_filter are merged into
+    a single color filter, so the image is split into channels once, each
+    channel goes through all of the greyscale filters, and the channels are
+    recombined once at the end (this gives exactly the same output).
+
+    If fuse is True, runs of consecutive linear filters (those made by
+    make_blur_filter, make_sharpen_filter or make_correlation_filter) with the
+    same boundary behavior are also replaced by one correlation with the
+    combined kernel, rounded and clipped once at the end instead of after
+    every filter.  This is much faster for long runs, but the output can
+    differ slightly from applying the filters one by one: intermediate
+    rounding and clipping is skipped, and pixels within the combined kernel's
+    radius of the border see a different boundary.
     """
+    stages = []
+    i = 0
+    while i < len(filters_list):
+        filt = filters_list[i]
+        j = i + 1
+        if hasattr(filt, 'greyscale_filter'):
+            while j < len(filters_list) and hasattr(filters_list[j], 'greyscale_filter'):
+                j += 1
+            inner = filter_cascade([f.greyscale_filter for f in filters_list[i:j]], fuse)
+            filt = color_filter_from_greyscale_filter(inner)
+        elif fuse and hasattr(filt, 'kernel'):
+            kernel = filt.kernel
+            while (j < len(filters_list) and hasattr(filters_list[j], 'kernel')
+                   and filters_list[j].boundary_behavior == filt.boundary_behavior
+                   and combine_kernels(kernel, filters_list[j].kernel) is not None):
+                kernel = combine_kernels(kernel, filters_list[j].kernel)
+                j += 1
+            if j > i + 1:
+                filt = make_correlation_filter(kernel, filt.boundary_behavior)
+        stages.append(filt)
+        i = j
+
     def cascade_image(image):
 
-        for filter in filters_list:
+        for filter in stages:
              image = filter(image)
         
         return image
     
     return cascade_image
 
+def combine_kernels(first, second):
+    """
+    Return the kernel equivalent to correlating with first and then with
+    second (ignoring boundaries), or None if the two kernels' centers cannot
+    be lined up (two even-sized kernels).  The result is (n1 + n2 - 1) wide.
+    """
+    n1 = int(math.sqrt(len(first)))
+    n2 = int(math.sqrt(len(second)))
+    n = n1 + n2 - 1
+    if n//2 != n1//2 + n2//2:
+        return None
+
+    combined = [0] * (n*n)
+    for a in range(n1):
+        for b in range(n1):
+            weight = first[n1*a + b]
+            if weight:
+                for c in range(n2):
+                    for d in range(n2):
+                        combined[n*(a + c) + b + d] += weight * second[n2*c + d]
+    return combined
+
+
+# PLANAR COLOR IMAGES
+
+class PlanarImage:
+    """
+    A color image stored as three planes (red, green and blue), each a flat
+    array('B') of height*width bytes in row-major order, instead of a list of
+    one (r, g, b) tuple per pixel.
+
+    planes() returns greyscale images whose 'pixels' are memoryviews of the
+    planes, so no pixels are copied; all of the greyscale filters accept
+    them.  Color filters made by color_filter_from_greyscale_filter accept
+    PlanarImages and run their greyscale filter on the planes directly.
+    """
+    def __init__(self, height, width, red, green, blue):
+        self.height = height
+        self.width = width
+        self.red = red
+        self.green = green
+        self.blue = blue
+
+    @classmethod
+    def from_image(cls, image):
+        """
+        Build a PlanarImage from a color image dictionary.
+        """
+        if image['pixels']:
+            red, green, blue = zip(*image['pixels'])
+        else:
+            red = green = blue = ()
+        return cls(image['height'], image['width'], array('B', red), array('B', green), array('B', blue))
+
+    @classmethod
+    def from_planes(cls, red, green, blue):
+        """
+        Build a PlanarImage from three greyscale images of the same size
+        (with pixels already rounded and clipped to [0, 255]; other values
+        raise an error, as array('B', ...) does, rather than wrapping around).
+        """
+        planes = []
+        for plane in (red, green, blue):
+            pixels = plane['pixels']
+            if np is not None and isinstance(pixels, np.ndarray):
+                # astype would silently wrap values outside [0, 255]
+                pixels = pixels.astype(np.uint8).tobytes() if _is_byte_array(pixels) else pixels.tolist()
+            planes.append(array('B', pixels))
+        return cls(red['height'], red['width'], *planes)
+
+    def to_image(self):
+        """
+        Return this image as a color image dictionary with one tuple per pixel.
+        """
+        return {'height': self.height, 'width': self.width, 'pixels': list(zip(self.red, self.green, self.blue))}
+
+    def planes(self):
+        """
+        Return the red, green and blue planes as greyscale images whose
+        'pixels' are read-only views of this image's arrays.
+        """
+        return tuple({'height': self.height, 'width': self.width, 'pixels': memoryview(plane).toreadonly()}
+                     for plane in (self.red, self.green, self.blue))
+
+    def filtered(self, filt):
+        """
+        Return a new PlanarImage with the given greyscale filter applied to
+        each plane.
+        """
+        return PlanarImage.from_planes(*(filt(plane) for plane in self.planes()))
+
+    def greyscale(self):
+        """
+        Return the greyscale version of this image (the same as
+        greyscale_image_from_color_image on the equivalent dictionary).
+        """
+        pixels = _greyscale_pixels(self.red, self.green, self.blue)
+        return {'height': self.height, 'width': self.width, 'pixels': pixels}
+
+
+# PARALLEL FILTERING
+
+# the filter being run by tiled_filter's worker processes; set before the
+# pool is started so that forked workers inherit it (filters are usually
+# closures, which cannot be pickled)
+_TILE_FILTER = None
+
+def _filter_tile(tile):
+    return _TILE_FILTER(tile)['pixels']
+
+def tiled_filter(filt, radius, boundary_behavior='extend', processes=None, threads=False):
+    """
+    Return a filter that gives the same output as filt, but splits the image
+    into horizontal bands and filters the bands in parallel.
+
+    filt must be local: each output pixel may only depend on input pixels at
+    most radius rows away (e.g. radius n//2 for an n by n kernel, 1 for
+    edges, and the sum of the radii for a cascade).  Each band is extended
+    by radius rows of its neighbors (a halo) so that its own rows come out
+    exactly as in the full image, and the halo rows are dropped afterwards.
+    At the top and bottom of the image no halo is added, so filt's own
+    boundary behavior applies there, except for 'wrap', where the halo is
+    taken from the opposite side of the image.  Seam carving is not local
+    and cannot be tiled.
+
+    Bands are filtered by a pool of processes (forked, so filt does not need
+    to be picklable), or by threads if threads is True, which only helps for
+    filters that spend their time in NumPy.  processes defaults to the
+    number of CPUs.
+    """
+    def tiled_filtered(image):
+        height, width = image['height'], image['width']
+        pixels = image['pixels']
+        workers = processes or os.cpu_count() or 1
+        band_height = max(-(-height // workers), 2*radius + 1)
+
+        tiles = []
+        crops = []
+        for start in range(0, height, band_height):
+            end = min(start + band_height, height)
+            if boundary_behavior == 'wrap':
+                above = below = radius
+                rows = [x % height for x in range(start - radius, end + radius)]
+            else:
+                above = min(radius, start)
+                below = min(radius, height - end)
+                rows = list(range(start - above, end + below))
+            if rows == list(range(rows[0], rows[-1] + 1)):
+                tile_pixels = pixels[width*rows[0]:width*(rows[-1] + 1)]
+            else:
+                tile_pixels = [p for x in rows for p in pixels[width*x:width*(x + 1)]]
+            tiles.append({'height': len(rows), 'width': width, 'pixels': tile_pixels})
+            crops.append((width*above, width*(above + end - start)))
+
+        if len(tiles) == 1:
+            results = [filt(tiles[0])['pixels']]
+        elif threads:
+            with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+                results = list(pool.map(lambda tile: filt(tile)['pixels'], tiles))
+        else:
+            global _TILE_FILTER
+            _TILE_FILTER = filt
+            try:
+                with multiprocessing.get_context('fork').Pool(workers) as pool:
+                    results = pool.map(_filter_tile, tiles)
+            finally:
+                _TILE_FILTER = None
+
+        pieces = [result[first:last] for result, (first, last) in zip(results, crops)]
+        if np is not None and isinstance(pieces[0], np.ndarray):
+            new_pixels = np.concatenate(pieces)
+        else:
+            new_pixels = [p for piece in pieces for p in piece]
+        return {'height': height, 'width': width, 'pixels': new_pixels}
+
+    return tiled_filtered
+
 
 # SEAM CARVING
 
 # Main Seam Carving Implementation
 
 
-def seam_carving(image, ncols):
+def seam_carving(image, ncols, incremental=True):
     """
     Starting from the given image, use the seam carving technique to remove
     ncols (an integer) columns from the image. Returns a new image.
+
+    By default the energy and cumulative energy maps are computed once and
+    then updated after each seam is removed (see _carve_incremental), which
+    gives exactly the same output as recomputing them from scratch.  Pass
+    incremental=False to recompute everything for every seam.
     """
-    new_image = {'height': image['height'], 'width': image['width'], 'pixels': image['pixels'][:]}
+    if incremental:
+        return _carve_incremental(image, ncols)[0]
+
+    new_image = image
 
     for i in range(ncols):
         greyscale_image = greyscale_image_from_color_image(new_image)
         energy_image = compute_energy(greyscale_image)
-        c_energy_map = cumulative_energy_map(energy_image)
-        seam = minimum_energy_seam(c_energy_map)
+        c_energy_map, backpointers = cumulative_energy_map_with_backpointers(energy_image)
+        seam = minimum_energy_seam(c_energy_map, backpointers)
         new_image = image_without_seam(new_image, seam)
     
     return new_image
 
+
+def seam_carving_horizontal(image, nrows, incremental=True):
+    """
+    Remove nrows horizontal seams from the given image, by carving vertical
+    seams out of a transposed view of it.  Returns a new image.
+    """
+    carved = seam_carving(transposed_image(image), nrows, incremental)
+    return _untransposed(carved)
+
+
+def seam_insertion(image, ncols):
+    """
+    Widen the given image by ncols columns.  The lowest-energy seams are found
+    with one incremental carving pass over the image, and then every pixel on
+    one of those seams is duplicated in a single pass over the rows (the new
+    pixel is the average of the seam pixel and its right neighbor).  To widen
+    by more than the image's width less one, this is repeated on the result.
+    Returns a new image.
+    """
+    while ncols > 0:
+        count = min(ncols, max(image['width'] - 1, 1))
+        image = _image_with_seams(image, _carve_incremental(image, count)[1])
+        ncols -= count
+    return image
+
+
+def retarget(image, height, width, optimal=False):
+    """
+    Resize the given image to the given height and width using seam carving
+    (removing seams to shrink, inserting them to enlarge).  Returns a new
+    image.
+
+    By default all of the vertical seams are handled before the horizontal
+    ones.  If optimal is True and the image is shrinking in both directions,
+    the order of vertical and horizontal seam removals is chosen to minimize
+    the total energy removed, using the dynamic program over (rows removed,
+    columns removed) from Avidan and Shamir's paper.  This carves about twice
+    as many seams as there are cells in that table, so it is only practical
+    for small reductions.
+    """
+    dcols, drows = image['width'] - width, image['height'] - height
+
+    if optimal and dcols > 0 and drows > 0:
+        #previous[j] holds (total energy, image) with i - 1 rows and j columns removed
+        previous = None
+        for i in range(drows + 1):
+            current = []
+            for j in range(dcols + 1):
+                options = []
+                if i == 0 and j == 0:
+                    options.append((0, image))
+                if j > 0:
+                    cost, source = current[j - 1]
+                    carved, _, energies = _carve_incremental(source, 1)
+                    options.append((cost + energies[0], carved))
+                if i > 0:
+                    cost, source = previous[j]
+                    carved, _, energies = _carve_incremental(transposed_image(source), 1)
+                    options.append((cost + energies[0], _untransposed(carved)))
+                current.append(min(options, key=lambda option: option[0]))
+            previous = current
+        return previous[dcols][1]
+
+    if dcols > 0:
+        image = seam_carving(image, dcols)
+    elif dcols < 0:
+        image = seam_insertion(image, -dcols)
+    if drows > 0:
+        image = seam_carving_horizontal(image, drows)
+    elif drows < 0:
+        image = _untransposed(seam_insertion(transposed_image(image), -drows))
+    return image
+
+
+class TransposedPixels:
+    """
+    Read-only view of an image's pixels in column-major order, so that row x
+    of the view is column x of the image.  Indexing and slicing read through
+    to the original pixels; nothing is copied up front.
+    """
+    def __init__(self, pixels, height, width):
+        self.pixels = pixels
+        self.height = height
+        self.width = width
+
+    def __len__(self):
+        return self.height * self.width
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        y, x = divmod(index, self.height)
+        return self.pixels[self.width*x + y]
+
+    def __iter__(self):
+        pixels, width = self.pixels, self.width
+        for y in range(width):
+            yield from pixels[y::width]
+
+
+def transposed_image(image):
+    """
+    Return the transpose of the given image (its height and width swapped),
+    whose 'pixels' are a TransposedPixels view of the original pixels.
+    Transposing a transposed image gives back the original pixels.
+    """
+    pixels = image['pixels']
+    if isinstance(pixels, TransposedPixels):
+        pixels = pixels.pixels
+    else:
+        pixels = TransposedPixels(pixels, image['height'], image['width'])
+    return {'height': image['width'], 'width': image['height'], 'pixels': pixels}
+
+
+def _untransposed(image):
+    """
+    Transpose an image carved in transposed form back, copying its pixels
+    into a plain list.
+    """
+    image = transposed_image(image)
+    return {'height': image['height'], 'width': image['width'], 'pixels': list(image['pixels'])}
+
+
+def _image_with_seams(image, seams):
+    """
+    Given an image and seams as lists of (original) column indices, one per
+    row, return a new image in which every seam pixel is followed by a new
+    pixel averaging it with its right neighbor.
+    """
+    height, width = image['height'], image['width']
+    pixels = image['pixels']
+    duplicated = [set() for _ in range(height)]
+    for seam in seams:
+        for x, y in enumerate(seam):
+            duplicated[x].add(y)
+
+    new_pixels = []
+    for x in range(height):
+        row = pixels[width*x:width*(x + 1)]
+        columns = duplicated[x]
+        for y, pixel in enumerate(row):
+            new_pixels.append(pixel)
+            if y in columns:
+                neighbor = row[min(y + 1, width - 1)]
+                new_pixels.append(tuple(round((a + b) / 2) for a, b in zip(pixel, neighbor)))
+
+    return {'height': height, 'width': width + len(seams), 'pixels': new_pixels}
+
+
+def _carve_incremental(image, ncols):
+    """
+    Seam carving that keeps the greyscale image, the energy map and the
+    cumulative energy map (each as a list of rows) between seams.
+
+    Removing a seam only changes the energy of pixels whose 3x3 neighborhood
+    straddled it, i.e. columns min(seam) - 1 through max(seam) of the
+    neighboring rows, so only those are recomputed.  The cumulative map is
+    then updated from the top down: in each row we recompute the columns
+    whose energy or row-above neighbors changed, plus the columns next to any
+    value that actually changed in the row above, so the recomputed band
+    stays as narrow as the changes allow.
+
+    Returns the carved image, the removed seams (each as a list of columns
+    of the original image, one per row, top to bottom) and the total energy
+    of each seam.
+    """
+    height, width = image['height'], image['width']
+    grey = greyscale_image_from_color_image(image)['pixels']
+    energy = compute_energy({'height': height, 'width': width, 'pixels': grey})['pixels']
+
+    pixel_rows = [image['pixels'][x*width:(x + 1)*width] for x in range(height)]
+    grey_rows = [grey[x*width:(x + 1)*width] for x in range(height)]
+    energy_rows = [list(energy[x*width:(x + 1)*width]) for x in range(height)]
+    cem = cumulative_energy_map({'height': height, 'width': width, 'pixels': energy})['pixels']
+    cem_rows = [cem[x*width:(x + 1)*width] for x in range(height)]
+    column_rows = [list(range(width)) for x in range(height)]
+    seams, energies = [], []
+
+    for i in range(ncols):
+        seam = _seam_columns(cem_rows)
+        seams.append([column_rows[x][y] for x, y in enumerate(seam)])
+        energies.append(cem_rows[-1][seam[-1]])
+        for x, y in enumerate(seam):
+            del pixel_rows[x][y], grey_rows[x][y], energy_rows[x][y], cem_rows[x][y], column_rows[x][y]
+        width -= 1
+        if i == ncols - 1:
+            break
+
+        # columns (in the narrower image) whose energy may have changed
+        dirty = []
+        for x in range(height):
+            near = seam[max(x - 1, 0):x + 2]
+            first, last = max(min(near) - 1, 0), min(max(near), width - 1)
+            energy_row = energy_rows[x]
+            for y in range(first, last + 1):
+                energy_row[y] = _pixel_energy(grey_rows, x, y)
+            dirty.append((first, last))
+
+        first, last = dirty[0]
+        cem_rows[0][first:last + 1] = energy_rows[0][first:last + 1]
+        changed = (first, last)
+        for x in range(1, height):
+            first, last = dirty[x]
+            if changed is not None:
+                first, last = max(min(first, changed[0] - 1), 0), min(max(last, changed[1] + 1), width - 1)
+            above, row, energy_row = cem_rows[x - 1], cem_rows[x], energy_rows[x]
+            changed = None
+            for y in range(first, last + 1):
+                value = energy_row[y] + min(above[max(y - 1, 0):y + 2])
+                if value != row[y]:
+                    row[y] = value
+                    changed = (y, y) if changed is None else (changed[0], y)
+
+    new_image = {'height': height, 'width': width, 'pixels': [p for row in pixel_rows for p in row]}
+    return new_image, seams, energies
+
+
+def _pixel_energy(grey_rows, x, y):
+    """
+    Energy (as computed by compute_energy) of the pixel at row x, column y of
+    a greyscale image given as a list of rows, using the 'extend' boundary
+    behavior.
+    """
+    height, width = len(grey_rows), len(grey_rows[0])
+    top, middle, bottom = grey_rows[max(x - 1, 0)], grey_rows[x], grey_rows[min(x + 1, height - 1)]
+    left, right = max(y - 1, 0), min(y + 1, width - 1)
+    ox = (top[right] - top[left]) + 2*(middle[right] - middle[left]) + (bottom[right] - bottom[left])
+    oy = (bottom[left] + 2*bottom[y] + bottom[right]) - (top[left] + 2*top[y] + top[right])
+    return min(round((ox**2 + oy**2)**(1/2)), 255)
+
+
+def _seam_columns(cem_rows):
+    """
+    Given a cumulative energy map as a list of rows, return the column of the
+    minimum-energy seam in each row (top to bottom), breaking ties to the left
+    the same way minimum_energy_seam does.
+    """
+    bottom = cem_rows[-1]
+    y = bottom.index(min(bottom))
+    seam = [y]
+    for row in reversed(cem_rows[:-1]):
+        first = max(y - 1, 0)
+        neighbors = row[first:y + 2]
+        y = first + neighbors.index(min(neighbors))
+        seam.append(y)
+    seam.reverse()
+    return seam
+
 # Optional Helper Functions for Seam Carving
 
 
@@ -295,15 +1189,39 @@ def greyscale_image_from_color_image(image):
 
     Returns a greyscale image (represented as a dictionary).
     """
-    greyscale_pixels = []
-
-    for pixel in image['pixels']:
-        v = round(0.299 * pixel[0] + 0.587 * pixel[1] + 0.114 * pixel[2])
-        greyscale_pixels.append(v)
+    if isinstance(image, PlanarImage):
+        return image.greyscale()
+
+    red_table, green_table, blue_table = _GREYSCALE_PRODUCTS
+    try:
+        #color pixels are (r, g, b) tuples of 8-bit integers, so the products can be looked up
+        greyscale_pixels = [round(red_table[r] + green_table[g] + blue_table[b]) for r, g, b in image['pixels']]
+    except (TypeError, ValueError, KeyError):
+        greyscale_pixels = []
+
+        for pixel in image['pixels']:
+            v = round(0.299 * pixel[0] + 0.587 * pixel[1] + 0.114 * pixel[2])
+            greyscale_pixels.append(v)
     
     return {'height': image['height'], 'width': image['width'], 'pixels': greyscale_pixels}
 
 
+# 0.299*c, 0.587*c and 0.114*c for every 8-bit value c
+GREYSCALE_TABLES = tuple(lookup_table(lambda c, w=w: w * c) for w in (0.299, 0.587, 0.114))
+
+# the same products keyed by channel value, so that a value outside [0, 255]
+# (including a negative one, which would index a list from the end) is a KeyError
+_GREYSCALE_PRODUCTS = tuple(dict(enumerate(table)) for table in GREYSCALE_TABLES)
+
+def _greyscale_pixels(red, green, blue):
+    # the greyscale values of the pixels with the given (8-bit) channels,
+    # looking the products up instead of multiplying; the sums are formed in
+    # the same order as in greyscale_image_from_color_image, so the results
+    # are identical
+    red_table, green_table, blue_table = GREYSCALE_TABLES
+    return [round(red_table[r] + green_table[g] + blue_table[b]) for r, g, b in zip(red, green, blue)]
+
+
 def compute_energy(grey):
     """
     Given a greyscale image, computes a measure of "energy", in our case using
@@ -330,96 +1248,91 @@ def cumulative_energy_map(energy):
            the value of that location in the energy map, added to the
            minimum of the cumulative energies from the "adjacent" pixels in the row
            above
-    """
-    c_e_m = {'height': energy['height'], 'width': energy['width'], 'pixels': energy['pixels']}
 
-    for x in range(c_e_m['height']):
-        for y in range(c_e_m['width']):
-            index = c_e_m['width']*x + y
-            index_row_above = c_e_m['width']*(x - 1) + y
-            if x != 0:
-                #consider pixels at the edges to make sure the pixel extracted is not out of range; compute the minimum of the adjacent pixels of the row above and set the cumulative energy as the minimum + pixel at the current location
-                if y == 0:
-                    c_e_m['pixels'][index] = c_e_m['pixels'][index] + min(c_e_m['pixels'][index_row_above], c_e_m['pixels'][index_row_above + 1])
-
-                elif y == c_e_m['width'] - 1:
-                    c_e_m['pixels'][index] = c_e_m['pixels'][index] + min(c_e_m['pixels'][index_row_above], c_e_m['pixels'][index_row_above - 1])
+    The energy image is not modified.
+    """
+    return cumulative_energy_map_with_backpointers(energy)[0]
 
-                else: 
-                    c_e_m['pixels'][index] = c_e_m['pixels'][index] + min(c_e_m['pixels'][index_row_above], c_e_m['pixels'][index_row_above - 1], c_e_m['pixels'][index_row_above + 1])
 
-    return c_e_m
+def cumulative_energy_map_with_backpointers(energy):
+    """
+    Compute the cumulative energy map of the given energy image together with
+    its backpointers: a list parallel to the map's 'pixels' giving, for each
+    pixel below the top row, the index of the adjacent pixel in the row above
+    that its minimum came from (the leftmost one in case of a tie).  Entries
+    for the top row are -1.  Returns a (cumulative energy map, backpointers)
+    tuple; the backpointers can be passed to minimum_energy_seam.
+
+    The map is built one row at a time: the row above is shifted one pixel
+    to the left and one to the right (repeating its edge values), and each
+    pixel adds the elementwise minimum of the three rows, so there is no
+    per-pixel edge handling.
+    """
+    height, width = energy['height'], energy['width']
+
+    if np is not None:
+        rows = np.asarray(energy['pixels']).reshape(height, width)
+        cem = rows.astype(np.int64 if rows.dtype.kind in 'biu' else float)
+        backpointers = np.full((height, width), -1)
+        columns = np.arange(width)
+        for x in range(1, height):
+            above = cem[x - 1]
+            candidates = np.stack((np.concatenate((above[:1], above[:-1])), above,
+                                   np.concatenate((above[1:], above[-1:]))))
+            choice = candidates.argmin(axis=0)
+            cem[x] += candidates[choice, columns]
+            backpointers[x] = width*(x - 1) + np.clip(columns + choice - 1, 0, width - 1)
+        cem, backpointers = cem.ravel(), backpointers.ravel()
+        if not is_array_image(energy):
+            cem, backpointers = cem.tolist(), backpointers.tolist()
+        return {'height': height, 'width': width, 'pixels': cem}, backpointers
+
+    pixels = energy['pixels']
+    cem = list(pixels[:width])
+    backpointers = [-1] * width
+    last = width - 1
+
+    for x in range(1, height):
+        above = cem[width*(x - 1):width*x]
+        left = above[:1] + above[:-1]
+        right = above[1:] + above[-1:]
+        minimums = list(map(min, left, above, right))
+        cem.extend(map(sum, zip(pixels[width*x:width*(x + 1)], minimums)))
+        start = width*(x - 1)
+        backpointers.extend(start + (max(y - 1, 0) if l == m else y if c == m else min(y + 1, last))
+                            for y, (l, c, m) in enumerate(zip(left, above, minimums)))
+
+    return {'height': height, 'width': width, 'pixels': cem}, backpointers
     
 
-def minimum_energy_seam(cem):
+def minimum_energy_seam(cem, backpointers=None):
     """
     Given a cumulative energy map, returns a list of the indices into the
     'pixels' list that correspond to pixels contained in the minimum-energy
     seam (computed as described in the lab 2 writeup).
-    """
-
-    indices_to_be_seamed = []
-
-    for x in range(cem['height']):
 
-        #find the minimum of the last row and append the index onto indices_to_be_seamed
-        if x == 0:
-            first_index = (cem['height']- 1) * cem['width']
-            last_index = (cem['height']) * cem['width']
-            row_list = cem['pixels'][first_index : last_index]
+    If the backpointers from cumulative_energy_map_with_backpointers are
+    given, the seam is found by following them up from the bottom row;
+    otherwise each step looks at the adjacent pixels in the row above.  In
+    both cases ties go to the leftmost pixel.
+    """
+    height, width = cem['height'], cem['width']
+    pixels = cem['pixels']
 
-            min_energy = min(row_list)
+    #start from the leftmost minimum of the bottom row
+    bottom = (height - 1) * width
+    index = min(range(bottom, bottom + width), key=pixels.__getitem__)
+    indices_to_be_seamed = [index]
 
-            indices_with_minimum_value = []
-        
-            for idx, value in enumerate(row_list):
-                if value == min_energy:
-                    indices_with_minimum_value.append(idx + (cem['height']- 1) * cem['width'])
-        
-            indices_to_be_seamed.append(min(indices_with_minimum_value))
-        
+    for x in range(height - 2, -1, -1):
+        if backpointers is not None:
+            index = backpointers[index]
         else:
-            #find the last index appended to indices_to_be_seamed to determine the adjacent pixels of the row above
-            latest_index = indices_to_be_seamed[len(indices_to_be_seamed) - 1]
-            
-            #consider if the last index appended to indices_to_be_seamed is on the edge of the image
-            if latest_index % cem['width'] == 0:
-
-                first_index = latest_index - cem['width']
-
-                #in the case in which both adjacent pixel return the minimum value, return the indices of the left pixel
-                if cem['pixels'][first_index] == cem['pixels'][first_index + 1]: indices_to_be_seamed.append(first_index)
-
-                else:
-                    
-                    if cem['pixels'][first_index] < cem['pixels'][first_index + 1]: indices_to_be_seamed.append(first_index)
-
-                    else: indices_to_be_seamed.append(first_index + 1)
-            
-            elif (latest_index % cem['width']) == (cem['width'] - 1):
-
-                first_index = latest_index - cem['width'] - 1
-
-                if cem['pixels'][first_index] == cem['pixels'][first_index + 1]: indices_to_be_seamed.append(first_index)
-
-                else:
-
-                    if cem['pixels'][first_index] < cem['pixels'][first_index + 1]: indices_to_be_seamed.append(first_index)
-
-                    else: indices_to_be_seamed.append(first_index + 1)                    
-                
-            else:
-                first_index = latest_index - cem['width'] - 1
-                min_energy_list = cem['pixels'][first_index : first_index + 3]
-                min_energy = min(min_energy_list)
-
-                indices_with_minimum_value = []
-        
-                for idx, value in enumerate(min_energy_list):
-                    if value == min_energy:
-                        indices_with_minimum_value.append(idx + latest_index - cem['width'] - 1)
-                
-                indices_to_be_seamed.append(min(indices_with_minimum_value))
+            y = index - width*(x + 1)
+            first = width*x + max(y - 1, 0)
+            last = width*x + min(y + 1, width - 1)
+            index = min(range(first, last + 1), key=pixels.__getitem__)
+        indices_to_be_seamed.append(int(index))
 
     return indices_to_be_seamed
 
@@ -430,32 +1343,70 @@ def image_without_seam(image, seam):
     pixels from the original image except those corresponding to the locations
     in the given list.
     """
-    #remove pixels from the back so the previous indices wouldn't be affected
-    pixels_removed = image['pixels']
-    index_removed = list(sorted(seam))
-    index_removed = index_removed[::-1]
+    return image_without_seams(image, [seam])
+
+
+def image_without_seams(image, seams):
+    """
+    Given an image and a list of seams, as returned by successive calls to
+    minimum_energy_seam (so each seam indexes into the image that is left
+    after removing the seams before it), return a new image without any of
+    them.  The original image is not modified.
+
+    The seams are first mapped back to columns of the original image; then
+    each row is built once from the slices between its removed columns (or,
+    for NumPy pixels, with a single boolean mask), instead of popping pixels
+    out of the middle of the list one at a time.
+    """
+    height, width = image['height'], image['width']
+    removed = [[] for _ in range(height)]
+
+    for n, seam in enumerate(seams):
+        seam_width = width - n
+        for index in seam:
+            x, y = divmod(index, seam_width)
+            columns = removed[x]
+            #shift y past the columns already removed from this row to get its original column
+            for column in columns:
+                if column > y:
+                    break
+                y += 1
+            bisect.insort(columns, y)
+
+    new_width = width - len(seams)
+    pixels = image['pixels']
+
+    if np is not None and isinstance(pixels, np.ndarray):
+        keep = np.ones(len(pixels), dtype=bool)
+        keep[[width*x + y for x, columns in enumerate(removed) for y in columns]] = False
+        return {'height': height, 'width': new_width, 'pixels': pixels[keep]}
 
-    for index in index_removed:
-        pixels_removed.pop(index)
+    new_pixels = []
+    for x, columns in enumerate(removed):
+        start = width*x
+        for column in columns:
+            new_pixels.extend(pixels[start:width*x + column])
+            start = width*x + column + 1
+        new_pixels.extend(pixels[start:width*(x + 1)])
 
-    return {'height': image['height'], 'width': image['width'] - 1, 'pixels': pixels_removed}
+    return {'height': height, 'width': new_width, 'pixels': new_pixels}
 
 def custom_feature(image):
     '''
     Given a (color) image return a new image that contains pixels with r = (r + g)/2, g = (g + b)/2, b = (b + r)/2; creating an image that bases its pixels on secondary colors
     '''
-    new_pixels = []
-
-    for pixel in image['pixels']:
-
-        average_tuple = (pixel[0] + pixel[1])//2, (pixel[1] + pixel[2])//2, (pixel[2] + pixel[0])//2
-        new_pixels.append(tuple(average_tuple))
+    new_pixels = [((r + g)//2, (g + b)//2, (b + r)//2) for r, g, b in image['pixels']]
     
     return {'height': image['height'], 'width': image['width'], 'pixels': new_pixels}
         
 
 # HELPER FUNCTIONS FOR LOADING AND SAVING COLOR IMAGES
 
+# The loaders and savers move pixels in and out of Pillow as one bytes
+# object (Image.tobytes / Image.frombytes) and split or interleave the
+# channels with slices, rather than going through getdata/putdata one pixel
+# at a time.
+
 
 def load_color_image(filename):
     """
@@ -468,21 +1419,38 @@ def load_color_image(filename):
     with open(filename, "rb") as img_handle:
         img = Image.open(img_handle)
         img = img.convert("RGB")  # in case we were given a greyscale image
-        img_data = img.getdata()
-        pixels = list(img_data)
+        data = img.tobytes()
+        pixels = list(zip(data[0::3], data[1::3], data[2::3]))
         w, h = img.size
         return {"height": h, "width": w, "pixels": pixels}
 
 
+def load_planar_image(filename):
+    """
+    Loads a color image from the given file as a PlanarImage.
+    """
+    with open(filename, "rb") as img_handle:
+        img = Image.open(img_handle)
+        img = img.convert("RGB")
+        w, h = img.size
+        return PlanarImage(h, w, *(array('B', band.tobytes()) for band in img.split()))
+
+
 def save_color_image(image, filename, mode="PNG"):
     """
     Saves the given color image to disk or to a file-like object.  If filename
     is given as a string, the file type will be inferred from the given name.
     If filename is given as a file-like object, the file type will be
     determined by the 'mode' parameter.
+
+    The image may also be a PlanarImage.
     """
-    out = Image.new(mode="RGB", size=(image["width"], image["height"]))
-    out.putdata(image["pixels"])
+    if isinstance(image, PlanarImage):
+        size = (image.width, image.height)
+        out = Image.merge("RGB", [Image.frombytes("L", size, bytes(plane))
+                                  for plane in (image.red, image.green, image.blue)])
+    else:
+        out = _image_from_pixels("RGB", image)
     if isinstance(filename, str):
         out.save(filename)
     else:
@@ -500,15 +1468,14 @@ def load_greyscale_image(filename):
     """
     with open(filename, "rb") as img_handle:
         img = Image.open(img_handle)
-        img_data = img.getdata()
+        data = img.tobytes()
         if img.mode.startswith("RGB"):
-            pixels = [
-                round(0.299 * p[0] + 0.587 * p[1] + 0.114 * p[2]) for p in img_data
-            ]
+            bands = len(img.getbands())
+            pixels = _greyscale_pixels(data[0::bands], data[1::bands], data[2::bands])
         elif img.mode == "LA":
-            pixels = [p[0] for p in img_data]
+            pixels = list(data[0::2])
         elif img.mode == "L":
-            pixels = list(img_data)
+            pixels = list(data)
         else:
             raise ValueError("Unsupported image mode: %r" % img.mode)
         w, h = img.size
@@ -522,8 +1489,7 @@ def save_greyscale_image(image, filename, mode="PNG"):
     filename is given as a file-like object, the file type will be determined
     by the 'mode' parameter.
     """
-    out = Image.new(mode="L", size=(image["width"], image["height"]))
-    out.putdata(image["pixels"])
+    out = _image_from_pixels("L", image)
     if isinstance(filename, str):
         out.save(filename)
     else:
@@ -531,25 +1497,413 @@ def save_greyscale_image(image, filename, mode="PNG"):
     out.close()
 
 
+def _image_from_pixels(mode, image):
+    """
+    Make a Pillow image of the given mode ("L" or "RGB") from an image
+    dictionary, copying the pixels in as a single bytes object when they are
+    all integers in [0, 255] and with putdata otherwise.
+    """
+    size = (image["width"], image["height"])
+    pixels = image["pixels"]
+    try:
+        if np is not None and isinstance(pixels, np.ndarray):
+            if not _is_byte_array(pixels):
+                # astype would wrap or truncate these; putdata clips them
+                raise ValueError("pixels are not all integers in [0, 255]")
+            data = pixels.astype(np.uint8).tobytes()
+        elif mode == "RGB":
+            data = bytearray(3 * len(pixels))
+            if pixels:
+                red, green, blue = zip(*pixels)
+                data[0::3], data[1::3], data[2::3] = bytes(red), bytes(green), bytes(blue)
+        else:
+            data = bytes(pixels)
+        return Image.frombytes(mode, size, bytes(data))
+    except (TypeError, ValueError):
+        out = Image.new(mode=mode, size=size)
+        out.putdata(pixels)
+        return out
+
+
+def iter_image_rows(filename, greyscale=False):
+    """
+    Yield the rows of the image in the given file one at a time, top to
+    bottom: lists of (r, g, b) tuples, or of greyscale values (computed as in
+    load_greyscale_image) if greyscale is True.
+
+    Non-interlaced 8-bit greyscale and RGB PNGs (with or without alpha) are
+    decoded incrementally, so only a couple of rows are ever held in memory
+    and images too large to decode all at once can be processed.  Other
+    files are decoded by Pillow in full and then handed out row by row.
+    """
+    with open(filename, "rb") as img_handle:
+        rows = _iter_png_rows(img_handle)
+        header = next(rows, None)
+        if header is None:
+            img_handle.seek(0)
+            rows = _iter_pillow_rows(img_handle)
+            header = next(rows)
+        channels = header
+
+        for row in rows:
+            if channels in (1, 2):
+                grey = row[0::channels]
+                yield list(grey) if greyscale else [(v, v, v) for v in grey]
+            elif greyscale:
+                yield _greyscale_pixels(row[0::channels], row[1::channels], row[2::channels])
+            else:
+                yield list(zip(row[0::channels], row[1::channels], row[2::channels]))
+
+
+# channels per pixel for the PNG color types _iter_png_rows can decode
+_PNG_CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}
+
+
+def _iter_png_rows(handle):
+    """
+    Generator over a PNG file: first yields the number of channels per
+    pixel, then each row as a bytes object of unfiltered samples.  Returns
+    without yielding anything if the file is not a PNG it can decode.
+    """
+    if handle.read(8) != b"\x89PNG\r\n\x1a\n":
+        return
+    header = handle.read(8)
+    if len(header) < 8 or header != struct.pack(">I4s", 13, b"IHDR"):
+        return
+    data = handle.read(13)
+    if len(data) < 13:
+        return
+    width, height, depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", data)
+    handle.read(4)  # crc
+    if depth != 8 or interlace or color_type not in _PNG_CHANNELS:
+        return
+
+    channels = _PNG_CHANNELS[color_type]
+    stride = width * channels
+    yield channels
+
+    decompressor = zlib.decompressobj()
+    buffer = b""
+    previous = bytes(stride)
+    produced = 0
+    while produced < height:
+        header = handle.read(8)
+        if len(header) < 8:
+            raise ValueError("truncated PNG file")
+        length, kind = struct.unpack(">I4s", header)
+        data = handle.read(length)
+        handle.read(4)  # crc
+        if kind == b"IEND":
+            raise ValueError("truncated PNG image data")
+        if kind != b"IDAT":
+            continue
+        while produced < height:
+            # inflate one scanline's worth at a time, so that a highly
+            # compressible chunk never expands to more than a couple of rows
+            inflated = decompressor.decompress(data, stride + 1)
+            data = decompressor.unconsumed_tail
+            if not inflated and not data:
+                break
+            buffer += inflated
+            start = 0
+            while len(buffer) - start > stride and produced < height:
+                previous = _unfiltered(buffer[start], buffer[start + 1:start + stride + 1], previous, channels)
+                start += stride + 1
+                produced += 1
+                yield previous
+            buffer = buffer[start:]
+
+
+def _unfiltered(filter_type, line, previous, bpp):
+    """
+    Undo the PNG filter of the given type on one scanline, given the
+    previous (unfiltered) scanline and the number of bytes per pixel.
+    """
+    if filter_type == 0:
+        return bytes(line)
+    if filter_type == 2:
+        return bytes([(a + b) & 0xff for a, b in zip(line, previous)])
+
+    out = bytearray(line)
+    for i in range(len(out)):
+        left = out[i - bpp] if i >= bpp else 0
+        if filter_type == 1:
+            out[i] = (out[i] + left) & 0xff
+        elif filter_type == 3:
+            out[i] = (out[i] + ((left + previous[i]) >> 1)) & 0xff
+        elif filter_type == 4:
+            up = previous[i]
+            up_left = previous[i - bpp] if i >= bpp else 0
+            p = left + up - up_left
+            pa, pb, pc = abs(p - left), abs(p - up), abs(p - up_left)
+            if pa <= pb and pa <= pc:
+                predictor = left
+            elif pb <= pc:
+                predictor = up
+            else:
+                predictor = up_left
+            out[i] = (out[i] + predictor) & 0xff
+        else:
+            raise ValueError("invalid PNG filter type %d" % filter_type)
+    return bytes(out)
+
+
+def _iter_pillow_rows(handle):
+    """
+    Same protocol as _iter_png_rows, for any image Pillow can open (decoding
+    it all at once).
+    """
+    img = Image.open(handle)
+    if img.mode not in ("L", "LA", "RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    channels = len(img.getbands())
+    stride = img.size[0] * channels
+    data = img.tobytes()
+    yield channels
+    for start in range(0, len(data), stride):
+        yield data[start:start + stride]
+
+
+# BATCH PROCESSING
+
+# image files run_batch picks up from the input directory
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+
+
+def parse_filter_spec(spec):
+    """
+    Build a filter on color images from a comma-separated list of steps,
+    applied left to right, for example 'blur:5,edges,seam:40'.  The steps
+    are:
+
+       blur:n        box blur with an n by n kernel
+       sharpen:n     unsharp mask with an n by n blur
+       edges         edge detection
+       invert        inversion
+       custom        custom_feature
+       seam:n        remove n columns by seam carving
+       seamrows:n    remove n rows by seam carving
+       resize:HxW    retarget to height H and width W
+
+    The per-channel steps are combined with filter_cascade, so consecutive
+    ones share a single split and recombination of the color channels.
+    Raises ValueError for an unknown or malformed step.
+    """
+    filters = []
+    for step in spec.split(','):
+        name, _, arg = step.strip().partition(':')
+        try:
+            if name in ('blur', 'sharpen'):
+                n = int(arg)
+                if n < 1:
+                    raise ValueError
+                make_filter = make_blur_filter if name == 'blur' else make_sharpen_filter
+                filt = color_filter_from_greyscale_filter(make_filter(n))
+            elif name == 'edges' and not arg:
+                filt = color_filter_from_greyscale_filter(edges)
+            elif name == 'invert' and not arg:
+                filt = color_filter_from_greyscale_filter(inverted)
+            elif name == 'custom' and not arg:
+                filt = custom_feature
+            elif name == 'seam':
+                filt = lambda image, ncols=int(arg): seam_carving(image, ncols)
+            elif name == 'seamrows':
+                filt = lambda image, nrows=int(arg): seam_carving_horizontal(image, nrows)
+            elif name == 'resize':
+                height, width = (int(v) for v in arg.lower().split('x'))
+                filt = lambda image, height=height, width=width: retarget(image, height, width)
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError('invalid filter step: %r' % step) from None
+        filters.append(filt)
+    return filter_cascade(filters)
+
+
+def process_image_file(job):
+    """
+    Load the image at input_path, apply the filter described by spec and save
+    the result to output_path, where job is an (input_path, output_path,
+    spec) tuple.  Returns a dict with the paths, the image size and the time
+    in seconds spent loading, filtering and saving.
+
+    If anything goes wrong (e.g. the file is not an image), the exception is
+    not raised; the dict has an 'error' entry describing it instead, so one
+    bad file does not stop a whole batch.
+    """
+    input_path, output_path, spec = job
+    try:
+        filt = parse_filter_spec(spec)
+
+        start = time.perf_counter()
+        image = load_color_image(input_path)
+        loaded = time.perf_counter()
+        result = filt(image)
+        filtered = time.perf_counter()
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        save_color_image(result, output_path)
+        saved = time.perf_counter()
+    except Exception as e:
+        return _failed_job(job, e)
+
+    return {
+        'input': input_path,
+        'output': output_path,
+        'height': image['height'],
+        'width': image['width'],
+        'load_sec': loaded - start,
+        'filter_sec': filtered - loaded,
+        'save_sec': saved - filtered,
+    }
+
+
+def _failed_job(job, error):
+    # the result dict for a job that raised the given exception
+    return {'input': job[0], 'output': job[1], 'error': '%s: %s' % (type(error).__name__, error)}
+
+
+def image_jobs(input_dir, output_dir, spec):
+    """
+    Yield a job for process_image_file for every image file under input_dir
+    (walked lazily, in sorted order), writing to the same relative path
+    under output_dir.
+    """
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                input_path = os.path.join(root, name)
+                output_path = os.path.join(output_dir, os.path.relpath(input_path, input_dir))
+                yield input_path, output_path, spec
+
+
+def run_batch(input_dir, output_dir, spec, processes=None, max_in_flight=None):
+    """
+    Apply the filter described by spec (see parse_filter_spec) to every image
+    under input_dir, writing the results under output_dir, in a pool of
+    processes.  Yields the dict returned by process_image_file for each image
+    as soon as it is done (so not necessarily in order).  An image that fails
+    gives a dict with an 'error' entry rather than stopping the batch.
+
+    If a worker process dies outright (e.g. killed for using too much
+    memory), the pool is broken and every image in flight is lost with it.
+    A new pool is started and those images are rerun one at a time, so that
+    only an image which kills its worker again is reported as failed, and the
+    rest of the batch carries on in the new pool.
+
+    The directory is walked lazily and at most max_in_flight images
+    (default: twice the number of processes) are submitted at a time, so
+    memory use does not grow with the number of images.  The spec is checked
+    before any work starts.
+    """
+    parse_filter_spec(spec)
+    processes = processes or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * processes
+
+    pool = concurrent.futures.ProcessPoolExecutor(processes)
+    pending = {}  # future -> job
+    lost = []  # jobs that were in flight when the pool broke
+
+    def collect(futures):
+        for future in futures:
+            job = pending.pop(future)
+            try:
+                yield future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                lost.append(job)
+            except Exception as e:
+                yield _failed_job(job, e)
+
+    def restart():
+        # replace the broken pool and rerun the lost jobs one at a time
+        nonlocal pool
+        yield from collect(list(pending))
+        pool.shutdown()
+        pool = concurrent.futures.ProcessPoolExecutor(processes)
+        while lost:
+            job = lost.pop(0)
+            try:
+                result = pool.submit(process_image_file, job).result()
+            except concurrent.futures.process.BrokenProcessPool as e:
+                result = _failed_job(job, e)
+                pool.shutdown()
+                pool = concurrent.futures.ProcessPoolExecutor(processes)
+            yield result
+
+    try:
+        for job in image_jobs(input_dir, output_dir, spec):
+            if len(pending) >= max_in_flight:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                yield from collect(done)
+            if lost:
+                yield from restart()
+            try:
+                future = pool.submit(process_image_file, job)
+            except concurrent.futures.process.BrokenProcessPool:
+                yield from restart()
+                future = pool.submit(process_image_file, job)
+            pending[future] = job
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            yield from collect(done)
+            if lost:
+                yield from restart()
+    finally:
+        pool.shutdown()
+
+
+def main(argv=None):
+    """
+    Command-line entry point, run as for example:
+       python lab_image_processing_2.py 'blur:3,edges' input_dir output_dir -j 4
+
+    Prints one tab-separated line of timings per image as it finishes (or a
+    JSON object per line with --json), followed by a summary line.  Images
+    that could not be processed are reported and counted, and the rest of
+    the batch carries on; the exit status is 1 if any image failed.
+    """
+    parser = argparse.ArgumentParser(description='Apply a filter to every image in a directory.')
+    parser.add_argument('spec', help="comma-separated filter steps, e.g. 'blur:5,edges,seam:40'")
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--max-in-flight', type=int, default=None, help='maximum number of images queued at once')
+    parser.add_argument('--json', action='store_true', help='print the timings as JSON lines')
+    args = parser.parse_args(argv)
+
+    try:
+        parse_filter_spec(args.spec)
+    except ValueError as e:
+        parser.error(str(e))
+    if not os.path.isdir(args.input_dir):
+        parser.error('%s is not a directory' % args.input_dir)
+
+    count = 0
+    failures = 0
+    total_pixels = 0
+    start = time.perf_counter()
+    for result in run_batch(args.input_dir, args.output_dir, args.spec, args.processes, args.max_in_flight):
+        count += 1
+        if 'error' in result:
+            failures += 1
+            if args.json:
+                print(json.dumps(result), flush=True)
+            else:
+                print('%s\tFAILED\t%s' % (result['input'], result['error']), flush=True)
+            continue
+        pixels = result['height'] * result['width']
+        total_pixels += pixels
+        if args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            print('%s\t%dx%d\tload %.3fs\tfilter %.3fs\tsave %.3fs\t%.0f px/s' % (
+                result['input'], result['height'], result['width'], result['load_sec'],
+                result['filter_sec'], result['save_sec'], pixels / max(result['filter_sec'], 1e-9)), flush=True)
+    elapsed = time.perf_counter() - start
+    print('%d images (%d failed), %d pixels in %.3fs (%.2f images/s)' % (
+        count, failures, total_pixels, elapsed, count / max(elapsed, 1e-9)), file=sys.stderr)
+    return 1 if failures else 0
+
+
 if __name__ == "__main__":
-    # code in this block will only be run when you explicitly run your script,
-    # and not when the tests are being run.  this is a good place for
-    # generating images, etc.
-    
-    # if we have a greyscale filter called inverted that inverts a greyscale
-    # image...
-    #inverted_grey_cat = inverted(load_greyscale_image('grey_frog.png'))
-    #inverted_grey_frog = inverted(load_greyscale_image('cat.png'))
-
-    # then the following will create a color version of that filter
-    #filter1 = color_filter_from_greyscale_filter(edges)
-    #filter2 = color_filter_from_greyscale_filter(make_blur_filter(5))
-    #filt = filter_cascade(list([filter1, filter1, filter2, filter1]))
-
-    #color_cascade = color_filter_from_greyscale_filter(filt)
-
-    # that can then be applied to color images to invert them (note that this
-    # should make a new color image, rather than mutating its input)
-    flood_input = custom_feature(load_color_image('flood_input.png'))
-    print(flood_input['height'])
-    print(flood_input['width'])
\ No newline at end of file
+    sys.exit(main())